@@ -0,0 +1,87 @@
+"""
+Rotating snapshots of a hunt database under HUNT_DIR/backups.
+
+Snapshots use SQLite's online backup API a few pages at a time, releasing the
+database between steps, so a backup never holds up a git hook's write for
+long.
+"""
+import os
+import re
+import shutil
+from datetime import datetime
+
+from hunt import settings
+
+SNAPSHOT_TIME_FORMAT = '%Y%m%d-%H%M%S'
+# What take_snapshot adds after the prefix: time, optional label, optional suffix
+SNAPSHOT_NAME = r'\d{8}-\d{6}(-[A-Za-z]\w*)?(-\d+)?\.db'
+
+
+def snapshot_prefix(database):
+    return os.path.splitext(os.path.basename(database))[0] + '-'
+
+
+def list_snapshots(database, backup_dir=None):
+    """Snapshots of `database`, oldest first."""
+    backup_dir = backup_dir or settings.BACKUP_DIR
+    # Matched exactly, so snapshots of another database whose name starts the
+    # same way (e.g. work-2.db next to work.db) are never listed, or rotated
+    pattern = re.compile(re.escape(snapshot_prefix(database)) + SNAPSHOT_NAME)
+    if not os.path.isdir(backup_dir):
+        return []
+    paths = [
+        os.path.join(backup_dir, name)
+        for name in os.listdir(backup_dir)
+        if pattern.fullmatch(name)
+    ]
+    return sorted(paths, key=lambda path: (os.path.getmtime(path), path))
+
+
+def take_snapshot(storage, label=None, keep=None, backup_dir=None):
+    """
+    Back up `storage` to a new snapshot, then delete the oldest snapshots of
+    the same database beyond `keep`. Returns the snapshot's path.
+    """
+    database = storage.database or 'memory.db'
+    path = new_snapshot_path(database, label, backup_dir)
+    # Written under a temporary name so a half written snapshot is never listed
+    tmp_path = path + '.tmp'
+    storage.backup_to(tmp_path)
+    os.replace(tmp_path, path)
+    rotate_snapshots(database, keep, backup_dir)
+    return path
+
+
+def copy_snapshot(database, label=None, keep=None, backup_dir=None):
+    """
+    Like take_snapshot, but copies the database file as it is, for when it
+    can't be opened as a database (e.g. it's corrupt).
+    """
+    path = new_snapshot_path(database, label, backup_dir)
+    tmp_path = path + '.tmp'
+    shutil.copyfile(database, tmp_path)
+    os.replace(tmp_path, path)
+    rotate_snapshots(database, keep, backup_dir)
+    return path
+
+
+def new_snapshot_path(database, label=None, backup_dir=None):
+    backup_dir = backup_dir or settings.BACKUP_DIR
+    os.makedirs(backup_dir, exist_ok=True)
+    name = snapshot_prefix(database) + datetime.now().strftime(SNAPSHOT_TIME_FORMAT)
+    if label:
+        name += '-' + label
+    path = os.path.join(backup_dir, name + '.db')
+    suffix = 1
+    while os.path.exists(path):
+        suffix += 1
+        path = os.path.join(backup_dir, '%s-%d.db' % (name, suffix))
+    return path
+
+
+def rotate_snapshots(database, keep=None, backup_dir=None):
+    """Delete the oldest snapshots of `database` beyond `keep`."""
+    keep = settings.BACKUP_KEEP if keep is None else keep
+    if keep > 0:
+        for old_snapshot in list_snapshots(database, backup_dir)[:-keep]:
+            os.remove(old_snapshot)
@@ -0,0 +1,143 @@
+"""
+Whole-database consistency checks.
+
+One pass over all history in time order (which SQLite reads straight off the
+history(time) index) finds orphaned records, unpaired starts and stops and
+sessions on different tasks that overlap, then the task statuses are checked
+against what the history says. Memory is one entry per task, time is linear.
+"""
+from itertools import groupby
+from operator import attrgetter
+
+from .constants import CURRENT
+from .constants import IN_PROGRESS
+from .constants import TODO
+from .utils import display_time
+
+ORPHAN = "Orphan history"
+UNPAIRED_START = "Unpaired start"
+UNPAIRED_STOP = "Unpaired stop"
+OVERLAP = "Overlapping sessions"
+MULTIPLE_CURRENT = "Multiple current tasks"
+WRONG_STATUS = "Wrong status"
+
+
+class Problem(object):
+    """Something wrong with the database and (usually) how to fix it."""
+
+    def __init__(self, kind, message, delete=None, insert=None, status=None):
+        self.kind = kind
+        self.message = message
+        # History record to delete, (taskid, is_start, time) record to insert,
+        # (taskid, status) to set
+        self.delete = delete
+        self.insert = insert
+        self.status = status
+
+    @property
+    def fixable(self):
+        return bool(self.delete or self.insert or self.status)
+
+    def __str__(self):
+        return "{kind}: {message}".format(kind=self.kind, message=self.message)
+
+    def __repr__(self):
+        return str(self)
+
+
+def find_problems(tasks, history):
+    """
+    `tasks` maps task ids to Tasks; `history` is every History record ordered
+    by time, then id. The fixes suggested by the problems, applied in order,
+    leave a consistent database.
+    """
+    problems = []
+    active = None  # The Start of the session going on, if any
+    has_history = set()
+
+    for time, records in groupby(history, key=attrgetter("time")):
+        records = list(records)
+        if active is not None:
+            # workon stops one task and starts the next in the same second
+            records.sort(key=lambda record: record.is_start or record.taskid != active.taskid)
+
+        for record in records:
+            task = tasks.get(record.taskid)
+            if task is None:
+                problems.append(Problem(
+                    ORPHAN,
+                    f"record {record.id} at {display_time(time)} "
+                    f"belongs to missing task {record.taskid}",
+                    delete=record,
+                ))
+                continue
+
+            if record.is_start:
+                if active is not None and active.taskid == record.taskid:
+                    problems.append(Problem(
+                        UNPAIRED_START,
+                        f"[yellow]{task.name}[/yellow] started again at {display_time(time)} "
+                        "without being stopped",
+                        delete=record,
+                    ))
+                    continue
+                if active is not None:
+                    problems.append(Problem(
+                        OVERLAP,
+                        f"[yellow]{tasks[active.taskid].name}[/yellow] was still going when "
+                        f"[yellow]{task.name}[/yellow] started at {display_time(time)}",
+                        insert=(active.taskid, False, time),
+                    ))
+                active = record
+            else:
+                if active is None or active.taskid != record.taskid:
+                    problems.append(Problem(
+                        UNPAIRED_STOP,
+                        f"[yellow]{task.name}[/yellow] stopped at {display_time(time)} "
+                        "without being started",
+                        delete=record,
+                    ))
+                    continue
+                active = None
+            has_history.add(record.taskid)
+
+    current_tasks = [task for task in tasks.values() if task.status == CURRENT]
+    if len(current_tasks) > 1:
+        problems.append(Problem(
+            MULTIPLE_CURRENT,
+            ", ".join(f"[yellow]{task.name}[/yellow]" for task in current_tasks),
+        ))
+
+    for task in tasks.values():
+        is_active = active is not None and active.taskid == task.id
+        if is_active and task.status != CURRENT:
+            # Assume it stopped when the status last changed
+            stop_time = max(task.last_modified, active.time)
+            problems.append(Problem(
+                UNPAIRED_START,
+                f"[yellow]{task.name}[/yellow] is {task.status} but was never stopped "
+                f"after starting at {display_time(active.time)}",
+                insert=(task.id, False, stop_time),
+                status=(task.id, IN_PROGRESS) if task.status == TODO else None,
+            ))
+        elif task.status == CURRENT and not is_active:
+            status = IN_PROGRESS if task.id in has_history else TODO
+            problems.append(Problem(
+                WRONG_STATUS,
+                f"[yellow]{task.name}[/yellow] is {CURRENT} but isn't being worked on",
+                status=(task.id, status),
+            ))
+        elif task.status == TODO and task.id in has_history:
+            problems.append(Problem(
+                WRONG_STATUS,
+                f"[yellow]{task.name}[/yellow] is {TODO} but has been worked on",
+                status=(task.id, IN_PROGRESS),
+            ))
+        elif task.status == IN_PROGRESS and task.id not in has_history:
+            problems.append(Problem(
+                WRONG_STATUS,
+                f"[yellow]{task.name}[/yellow] is {IN_PROGRESS} but has never been worked on",
+                status=(task.id, TODO),
+            ))
+
+    return problems
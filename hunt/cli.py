@@ -1,32 +1,60 @@
-import shutil
 import sys
 import os
+import sqlite3
 import tempfile
 from collections import defaultdict
 from subprocess import call
+from contextlib import nullcontext
 from contextlib import redirect_stdout
 from io import StringIO
 
-import sqlite3
 from rich import box
 from rich.console import Console
 from rich.table import Table
 
+from hunt import __version__
 from hunt import settings
+from .backup import copy_snapshot
+from .backup import list_snapshots
+from .cli_dispatcher import AmbiguousCommand
 from .cli_dispatcher import Dispatcher
+from .cli_dispatcher import NoSuchCommand
+from .completion import SHELLS
+from .completion import completion_cache_path
+from .completion import completion_script
 from .constants import CURRENT
 from .constants import FINISHED
 from .constants import HuntError
-from .constants import HuntCouldNotFindTaskError
+from .constants import HuntNotInitializedError
 from .constants import IN_PROGRESS
 from .constants import STATUSES
 from .constants import TODO
-from .hunt import History
+from .databases import database_paths
+from .databases import list_tasks
+from .databases import summarize
+from .git import POST_CHECKOUT_HOOK
+from .git import current_branch
+from .git import default_branches
+from .git import find_git_dir
+from .git import install_post_checkout_hook
 from .hunt import Hunt
-from .utils import calc_progress
+from .hunt import now
+from .journal import CREATE
+from .journal import STOP
+from .journal import WORKON
+from .journal import append_event
+from .journal import folding_path
+from .journal import journal_path
+from .remote import RemoteHunt
+from .stats import build_columns
+from .stats import estimate_accuracy
+from .storage import SQLiteStorage
 from .utils import display_progress
+from .utils import display_time
 from .utils import needs_init
+from .utils import parse_tags
 from .utils import parse_task
+from .utils import parse_time
 
 class Command:
     """
@@ -52,8 +80,21 @@ class Command:
         restart             Restart a finished task
         edit                Edit a task
         rm                  Remove task
+        stats               Compare estimates with actual time
+        completion          Print a shell completion script
+        report              Summarize time tracked per database
+        maintain            Report on and tidy up the database
+        git-sync            Work on the checked out git branch
+        backup              Snapshot the database
+        log                 Show work sessions in a time range
+        check               Check the database for inconsistencies
+        serve               Share hunt with a team over HTTP
     """
 
+    # Prefixes that stood for these commands before commands starting the
+    # same way were added
+    _prefixes = {"c": "create", "l": "ls", "re": "restart", "st": "stop"}
+
     def init(self, options, console):
         """Initialize hunt database
 
@@ -68,15 +109,37 @@ class Command:
             if not user_sure:
                 console.print("Aborting re-initialization")
                 return
-            shutil.rmtree(settings.HUNT_DIR)
-        os.mkdir(settings.HUNT_DIR)
-        conn = sqlite3.connect(settings.DATABASE)
-        conn.execute("CREATE TABLE tasks(id INTEGER PRIMARY KEY, name TEXT, estimate INTEGER, description TEXT, status TEXT, last_modified INTEGER)")
-        conn.execute("CREATE TABLE history(id INTEGER PRIMARY KEY, taskid INTEGER, is_start BOOLEAN, time INTEGER)")
-        conn.commit()
-        conn.close()
+            try:
+                snapshot = Hunt().backup(label="init")
+            except sqlite3.DatabaseError as error:
+                # Most likely why it's being re-initialized; keep the file anyway
+                snapshot = copy_snapshot(settings.DATABASE, label="init")
+                console.print(
+                    f"[yellow]Warning[/yellow]: Could not read the old database ({error}), "
+                    "so its file was copied as is"
+                )
+            console.print(f"Backed up the old database to [green]{snapshot}[/green]")
+            # Only this database goes; backups and other databases stay
+            for path in (
+                settings.DATABASE,
+                settings.DATABASE + "-wal",
+                settings.DATABASE + "-shm",
+                completion_cache_path(settings.DATABASE),
+                journal_path(settings.DATABASE),
+                folding_path(journal_path(settings.DATABASE)),
+            ):
+                if os.path.exists(path):
+                    os.remove(path)
+        os.makedirs(settings.HUNT_DIR, exist_ok=True)
+        SQLiteStorage(settings.DATABASE).create_schema()
 
     # flake8: noqa
+    def _hunt(self, readonly=False, fold=True):
+        """The hunt to use: the HUNT_REMOTE server if set, else the local database."""
+        if settings.REMOTE:
+            return RemoteHunt(settings.REMOTE, settings.REMOTE_USER)
+        return Hunt(readonly=readonly, fold=fold)
+
     def ls(self, options, console):
         """
         List tasks.
@@ -94,6 +157,12 @@ class Command:
             -f, --finished              List all Finished tasks
             -S, --starts-with=STRING    Only tasks that start with STRING
             -C, --contains=STRING       Only tasks that contain STRING
+            -D, --db-glob=PATTERN       List tasks from every database matching PATTERN
+                                        (relative to the hunt directory, e.g. '*.db')
+            -T, --tree                  Show subtasks under their parent task, with the
+                                        estimates and progress of subtasks rolled up
+            -g, --tag=TAGS              Only tasks with all of these (comma separated) tags
+            --any-tag                   With --tag, tasks with any of the tags instead
         """
         statuses = set()
         if options.get("--all"):
@@ -112,64 +181,117 @@ class Command:
             statuses.add(FINISHED)
         if not statuses:
             statuses.update([CURRENT, IN_PROGRESS, TODO])
+        tags = parse_tags(options["--tag"]) if options.get("--tag") else None
+
+        if options.get("--tree"):
+            if options.get("--db-glob"):
+                raise HuntError("[red]Error[/red]: --tree can't be combined with --db-glob")
+            self._print_tree(
+                self._hunt(readonly=True).get_task_tree(
+                    statuses=statuses,
+                    starts_with=options.get("--starts-with"),
+                    contains=options.get("--contains"),
+                    tags=tags,
+                    any_tag=options.get("--any-tag"),
+                ),
+                console,
+            )
+            return
 
-        # Get the filtered and sorted list of tasks to display
-        hunt = Hunt()
-        tasks = hunt.get_tasks(
-            statuses, starts_with=options.get("--starts-with"), contains=options.get("--contains")
-        )
-
-        # Calculate progress from history
-        history_records = hunt.get_history([task.id for task in tasks])
-        taskid2history = defaultdict(list)
-        for record in history_records:
-            taskid2history[record.taskid].append(record)
-        taskid2progress = defaultdict(int)
-        for taskid, task_history in taskid2history.items():
-            taskid2progress[taskid] = calc_progress(task_history)
+        taskid2tags = {}
+        if options.get("--db-glob"):
+            rows = list_tasks(
+                database_paths(options["--db-glob"]),
+                statuses,
+                starts_with=options.get("--starts-with"),
+                contains=options.get("--contains"),
+                tags=tags,
+                any_tag=options.get("--any-tag"),
+            )
+        else:
+            # Get the filtered and sorted list of tasks to display
+            hunt = self._hunt(readonly=True)
+            tasks = hunt.get_tasks(
+                statuses,
+                starts_with=options.get("--starts-with"),
+                contains=options.get("--contains"),
+                tags=tags,
+                any_tag=options.get("--any-tag"),
+            )
+            taskids = [task.id for task in tasks]
+            taskid2progress = hunt.get_progress_by_task(taskids)
+            taskid2tags = hunt.get_tags_by_task(taskids)
+            rows = [(None, task, taskid2progress[task.id]) for task in tasks]
 
         # Pretty diplay in a table with colors
-        table = Table(
-            "ID",
-            "NAME",
-            "ESTIMATE",
-            "PROGRESS",
-            "STATUS",
-            box=box.MINIMAL_HEAVY_HEAD,
-        )
-        for rowid, task in enumerate(tasks):
-            seconds = taskid2progress[task.id]
-            minutes, seconds = divmod(seconds, 60)
-            hours, minutes = divmod(minutes, 60)
-            row = (
+        columns = ["ID", "NAME", "ESTIMATE", "PROGRESS", "STATUS"]
+        if options.get("--db-glob"):
+            columns.insert(0, "DATABASE")
+        if taskid2tags:
+            columns.append("TAGS")
+        table = Table(*columns, box=box.MINIMAL_HEAVY_HEAD)
+        for label, task, progress in rows:
+            row = [
                 str(task.id),
                 task.name,
                 task.estimate_display,
-                display_progress(taskid2progress[task.id]),
+                display_progress(progress),
                 task.status,
+            ]
+            if label is not None:
+                row.insert(0, label)
+            if taskid2tags:
+                row.append(", ".join(taskid2tags.get(task.id, [])))
+            table.add_row(*row, style=self._status_style(task.status))
+        console.print(table)
+
+    def _print_tree(self, subtrees, console):
+        table = Table("ID", "NAME", "ESTIMATE", "PROGRESS", "STATUS", box=box.MINIMAL_HEAVY_HEAD)
+        for subtree in subtrees:
+            task = subtree.task
+            table.add_row(
+                str(task.id),
+                "  " * subtree.depth + task.name,
+                subtree.total_estimate_display,
+                display_progress(subtree.total_progress),
+                task.status,
+                style=self._status_style(task.status),
             )
-            style = None
-            if task.status == CURRENT:
-                style = "green"
-            elif task.status == IN_PROGRESS:
-                style = "yellow"
-            table.add_row(*row, style=style)
         console.print(table)
 
+    def _status_style(self, status):
+        if status == CURRENT:
+            return "green"
+        elif status == IN_PROGRESS:
+            return "yellow"
+        return None
+
     def show(self, options, console):
         """
-        Display task.
+        Display task, with the subtasks under it.
 
         Usage:
             show [<task-identifier>]
         """
-        hunt = Hunt()
+        hunt = self._hunt(readonly=True)
         if options["<task-identifier>"]:
             task = hunt.get_task(options["<task-identifier>"])
         else:
             task = hunt.get_current_task()
         console.print(hunt.display_task(task.id))
 
+        tags = hunt.get_tags_by_task([task.id]).get(task.id)
+        if tags:
+            console.print("TAGS: %s" % ", ".join(tags))
+        if task.parent_id is not None:
+            console.print("PARENT: %s" % hunt.get_task(task.parent_id).name)
+        subtrees = hunt.get_task_tree(root=task.id)
+        if subtrees[0].subtasks:
+            console.print("")
+            console.print("TOTAL ESTIMATE: %s" % subtrees[0].total_estimate_display)
+            console.print("TOTAL PROGRESS: %s" % display_progress(subtrees[0].total_progress))
+            self._print_tree(subtrees[1:], console)
+
     def create(self, options, console):
         """
         Create a new task.
@@ -180,12 +302,19 @@ class Command:
         Options:
             -e, --estimate=<estimate>           Add estimate (in hours)
             -d, --description=<description>     Add a description
+            -p, --parent=<task-identifier>      Make it a subtask of another task
+            -g, --tag=<tags>                    Tag it (comma separated tags)
         """
-        hunt = Hunt()
+        hunt = self._hunt()
+        parent_id = None
+        if options.get("--parent"):
+            parent_id = hunt.get_task(options["--parent"]).id
         task = hunt.create_task(
             options["<task-name>"],
             estimate=options["--estimate"],
             description=options["--description"],
+            parent_id=parent_id,
+            tags=parse_tags(options["--tag"]) if options.get("--tag") else None,
         )
         self.ls({"--starts-with": task.name}, console=console)
 
@@ -201,27 +330,24 @@ class Command:
             -e, --estimate=<estimate>           [Only for create] Add estimate (in hours)
             -d, --description=<description>     [Only for create] Add a description
         """
-        hunt = Hunt()
-        try:
-            task = hunt.get_task(
-                options["<task-identifier>"] or "$CURRENT", statuses=[CURRENT, IN_PROGRESS, TODO]
-            )
-        except HuntCouldNotFindTaskError:
-            if options["--create"]:
-                task = hunt.create_task(
-                    options["<task-identifier>"],
-                    estimate=options["--estimate"],
-                    description=options["--description"],
-                )
-            else:
-                raise
+        if settings.JOURNAL and not settings.REMOTE and not (
+            options["--estimate"] or options["--description"]
+        ):
+            event = CREATE if options["--create"] and options["<task-identifier>"] else WORKON
+            self._journal(event, options["<task-identifier>"] or "$CURRENT", console)
+            return
 
-        if options["--create"] and task.name != options["<task-identifier>"]:
-            task = hunt.create_task(
+        hunt = self._hunt()
+        if options["--create"] and options["<task-identifier>"]:
+            task = hunt.find_or_create_task(
                 options["<task-identifier>"],
                 estimate=options["--estimate"],
                 description=options["--description"],
             )
+        else:
+            task = hunt.get_task(
+                options["<task-identifier>"] or "$CURRENT", statuses=[CURRENT, IN_PROGRESS, TODO]
+            )
 
         hunt.workon_task(task.id)
         self.ls({"--open": True}, console=console)
@@ -233,7 +359,7 @@ class Command:
         Usage:
             restart <task-identifier>
         """
-        hunt = Hunt()
+        hunt = self._hunt()
         task = hunt.get_task(options["<task-identifier>"], statuses=[FINISHED])
         if task:
             hunt.workon_task(task.id)
@@ -246,10 +372,23 @@ class Command:
         Usage:
             stop
         """
-        hunt = Hunt()
+        if settings.JOURNAL and not settings.REMOTE:
+            self._journal(STOP, "", console)
+            return
+
+        hunt = self._hunt()
         hunt.stop_current_task()
         self.ls({"--open": True}, console=console)
 
+    def _journal(self, event, task_identifier, console):
+        """Record workon/stop in the journal without touching the database."""
+        if needs_init():
+            raise HuntNotInitializedError(
+                "[red]Error[/red]: Run [bold]hunt init[/bold] to initiliaze hunt database"
+            )
+        append_event(journal_path(settings.DATABASE), event, now(), task_identifier)
+        console.print("Journaled [yellow]%s[/yellow]" % (task_identifier or "stop"))
+
     def finish(self, options, console):
         """
         Finish a task (defaults to finish current task).
@@ -257,7 +396,7 @@ class Command:
         Usage:
             finish [<task-identifier>]
         """
-        hunt = Hunt()
+        hunt = self._hunt()
         task = None
         if options["<task-identifier>"]:
             task = hunt.get_task(options["<task-identifier>"])
@@ -277,7 +416,7 @@ class Command:
         Options:
             -t, --task-identifier=STRING     Specifiy task
         """
-        hunt = Hunt()
+        hunt = self._hunt()
         estimate = int(options["<estimate>"])
         task_identifier = options["--task-identifier"]
         if task_identifier:
@@ -297,10 +436,22 @@ class Command:
         """
         Edit a task. Use with caution.
 
+        With --parent, --no-parent, --tag or --untag, only the task's parent
+        or tags are changed. With --last or --since, only the end of the
+        history is edited (widened to start with a Start); the rest is kept.
+
         Usage:
-            edit [<task-identifier>]
+            edit [<task-identifier>] [options]
+
+        Options:
+            -p, --parent=<task-identifier>      Make it a subtask of another task
+            --no-parent                         Make it a top level task
+            -g, --tag=<tags>                    Add tags (comma separated)
+            -u, --untag=<tags>                  Remove tags (comma separated)
+            -n, --last=N                        Only edit the last N history records
+            --since=TIME                        Only edit history from TIME on (see log)
         """
-        hunt = Hunt()
+        hunt = self._hunt()
         if options["<task-identifier>"]:
             task = hunt.get_task(options["<task-identifier>"])
         else:
@@ -312,8 +463,40 @@ class Command:
             )
             return
 
+        if any(options.get(option) for option in ("--parent", "--no-parent", "--tag", "--untag")):
+            # A remote hunt's server applies each change on its own
+            with nullcontext() if settings.REMOTE else hunt.transaction():
+                if options.get("--parent") or options.get("--no-parent"):
+                    parent_id = None
+                    if options.get("--parent"):
+                        parent_id = hunt.get_task(options["--parent"]).id
+                    hunt.set_parent(task.id, parent_id)
+                if options.get("--tag"):
+                    hunt.tag_task(task.id, parse_tags(options["--tag"]))
+                if options.get("--untag"):
+                    hunt.untag_task(task.id, parse_tags(options["--untag"]))
+            self.ls({"--starts-with": task.name, "--all": True}, console=console)
+            return
+
+        if settings.REMOTE:
+            # Checked before the editor opens, so no edits are lost
+            raise HuntError(
+                "[red]Error[/red]: Only --parent, --no-parent, --tag and --untag are "
+                "available with a remote hunt (HUNT_REMOTE)"
+            )
+
+        preceding = window = None
+        if options.get("--last") or options.get("--since"):
+            if options.get("--last") and not options["--last"].isdigit():
+                raise HuntError("[red]Error[/red]: --last must be a number of records")
+            preceding, window = hunt.get_history_window(
+                task.id,
+                last=int(options["--last"]) if options.get("--last") else None,
+                since=parse_time(options["--since"], now()) if options.get("--since") else None,
+            )
+
         with tempfile.NamedTemporaryFile(mode="w", suffix=".tmp") as tf:
-            tf.write(hunt.display_task(task.id))
+            tf.write(hunt.display_task(task.id, history=window))
             tf.flush()
             call([settings.EDITOR, tf.name])
 
@@ -321,14 +504,11 @@ class Command:
                 tf.seek(0)
                 edit = tf.read()
 
-        task_dict = parse_task(edit)
-        hunt.remove_task(task.id)
-        new_task = hunt.create_task(
-            task_dict["name"], task_dict["estimate"], task_dict["description"]
-        )
-        hunt.update_task(new_task.id, "status", task_dict["status"])
-        for is_start, history_time in task_dict["history"]:
-            hunt.insert_history(History((None, new_task.id, is_start, history_time)))
+        if preceding is not None:
+            preceding = (bool(preceding.is_start), preceding.time)
+        task_dict = parse_task(edit, preceding=preceding)
+        hunt.backup(label="edit")
+        new_task = hunt.replace_task(task.id, task_dict, window=window)
 
         self.ls({"--starts-with": new_task.name, "--all": True}, console=console)
 
@@ -342,7 +522,7 @@ class Command:
         Options:
             -f, --force         No confirmation prompt
         """
-        hunt = Hunt()
+        hunt = self._hunt()
         task = hunt.get_task(options["<task-identifier>"])
 
         if options["--force"]:
@@ -357,11 +537,370 @@ class Command:
             hunt.remove_task(task.id)
             console.print(f"Removed [red]{task.name}[/red]!")
 
+    def stats(self, options, console):
+        """
+        Compare estimates with actual time spent on finished tasks.
+
+        Ratios are actual/estimate, so above 1.00 means it took longer than estimated.
+
+        Usage:
+            stats [options]
+
+        Options:
+            -w, --window=N      Number of tasks in the rolling trend [default: 20]
+        """
+        if not options["--window"].isdigit():
+            raise HuntError("[red]Error[/red]: --window must be a number of tasks")
+        hunt = self._hunt(readonly=True)
+        columns = build_columns(hunt.get_estimate_accuracy_rows())
+        accuracy = estimate_accuracy(columns, window=int(options["--window"]))
+        if not accuracy["count"]:
+            console.print("No finished tasks with estimates yet.")
+            return
+
+        console.print(
+            f"[bold]{accuracy['count']}[/bold] finished tasks: "
+            f"estimated [yellow]{accuracy['total_estimated']:.0f} hrs[/yellow], "
+            f"took [yellow]{accuracy['total_actual']:.1f} hrs[/yellow]"
+        )
+
+        table = Table("PERCENTILE", "RATIO", box=box.MINIMAL_HEAVY_HEAD)
+        for pct, ratio in accuracy["percentiles"]:
+            table.add_row(f"p{pct}", f"{ratio:.2f}")
+        console.print(table)
+
+        table = Table(
+            "ESTIMATE", "TASKS", "ESTIMATED", "ACTUAL", "MEAN RATIO", box=box.MINIMAL_HEAVY_HEAD
+        )
+        for bucket in accuracy["buckets"]:
+            style = "red" if bucket["mean_ratio"] > 1 else "green"
+            table.add_row(
+                bucket["label"],
+                str(bucket["count"]),
+                f"{bucket['estimated']:.0f} hrs",
+                f"{bucket['actual']:.1f} hrs",
+                f"{bucket['mean_ratio']:.2f}",
+                style=style,
+            )
+        console.print(table)
+
+        if accuracy["trend"]:
+            table = Table(
+                "FINISHED BY", f"RATIO (last {accuracy['window']} tasks)", box=box.MINIMAL_HEAVY_HEAD
+            )
+            for finished_time, ratio in accuracy["trend"]:
+                table.add_row(display_time(finished_time), f"{ratio:.2f}")
+            console.print(table)
+
+    def completion(self, options, console):
+        """
+        Print a shell completion script for commands and open task identifiers.
+
+        Usage:
+            completion (bash|zsh|fish)
+
+        Add one of these to your shell's startup file:
+            eval "$(hunt completion bash)"
+            source <(hunt completion zsh)
+            hunt completion fish | source
+        """
+        if not needs_init():
+            Hunt().update_completion_cache()
+        shell = next(shell for shell in SHELLS if options[shell])
+        commands = sorted(
+            name.replace("_", "-") for name in dir(self) if not name.startswith("_")
+        )
+        print(completion_script(shell, commands), end="")
+
+    def report(self, options, console):
+        """
+        Summarize tasks and time tracked, per database.
+
+        Usage:
+            report [options]
+
+        Options:
+            -D, --db-glob=PATTERN       Report on every database matching PATTERN
+                                        (relative to the hunt directory, e.g. '*.db')
+        """
+        if options["--db-glob"]:
+            summaries = summarize(database_paths(options["--db-glob"]))
+        else:
+            summaries = [(None, self._hunt(readonly=True).get_summary())]
+
+        table = Table("DATABASE", *STATUSES, "ESTIMATED", "TRACKED", box=box.MINIMAL_HEAVY_HEAD)
+        total_counts = defaultdict(int)
+        total_estimated = total_tracked = 0
+        for label, summary in summaries:
+            estimated = sum(summary["estimates"].values())
+            table.add_row(
+                label or os.path.splitext(os.path.basename(settings.DATABASE))[0],
+                *[str(summary["counts"][status]) for status in STATUSES],
+                "%d hrs" % estimated,
+                display_progress(summary["tracked"]),
+            )
+            for status in STATUSES:
+                total_counts[status] += summary["counts"][status]
+            total_estimated += estimated
+            total_tracked += summary["tracked"]
+        if len(summaries) > 1:
+            table.add_row(
+                "TOTAL",
+                *[str(total_counts[status]) for status in STATUSES],
+                "%d hrs" % total_estimated,
+                display_progress(total_tracked),
+                style="bold",
+            )
+        console.print(table)
+
+    def maintain(self, options, console):
+        """
+        Report database health, then vacuum free pages and refresh statistics.
+
+        This also runs on its own every HUNT_MAINTAIN_EVERY writes (default 500).
+
+        Usage:
+            maintain [options]
+
+        Options:
+            -n, --dry-run       Only report, don't change anything
+        """
+        hunt = self._hunt()
+        before = hunt.get_health()
+        self._print_health(before, console)
+        if options["--dry-run"]:
+            return
+
+        hunt.maintain()
+        after = hunt.get_health()
+        freed = max(before["freelist_count"] - after["freelist_count"], 0)
+        console.print(
+            f"Reclaimed [green]{freed * after['page_size']}[/green] bytes of free pages "
+            f"and refreshed query planner statistics."
+        )
+
+    def _print_health(self, health, console):
+        fragmentation = health["freelist_count"] / max(health["page_count"], 1)
+        console.print(
+            f"{health['page_count']} pages of {health['page_size']} bytes, "
+            f"{health['freelist_count']} free ([yellow]{fragmentation:.0%}[/yellow] fragmentation), "
+            f"auto_vacuum {health['auto_vacuum']}, "
+            f"{health['writes']} writes since last maintenance"
+        )
+        style = "green" if health["integrity"] == "ok" else "red"
+        console.print(f"Integrity check: [{style}]{health['integrity']}[/{style}]")
+
+        table = Table("TABLE", "ROWS", "BYTES", box=box.MINIMAL_HEAVY_HEAD)
+        for name, rows, size in health["tables"]:
+            table.add_row(name, str(rows), "?" if size is None else str(size))
+        console.print(table)
+
+        table = Table("INDEX", "TABLE", "BYTES", box=box.MINIMAL_HEAVY_HEAD)
+        for name, table_name, size in health["indexes"]:
+            table.add_row(name, table_name, "?" if size is None else str(size))
+        console.print(table)
+
+        table = Table("QUERY", "PLAN", box=box.MINIMAL_HEAVY_HEAD)
+        for description, plan in health["query_plans"]:
+            table.add_row(description, plan, style=None if "INDEX" in plan else "yellow")
+        console.print(table)
+        if not health["analyzed"]:
+            console.print("[yellow]No query planner statistics yet[/yellow]")
+
+    def git_sync(self, options, console):
+        """
+        Work on the task named after the checked out git branch (created if
+        needed), or stop working when on the default branch.
+
+        The default branch is origin's HEAD (else main or master), or
+        HUNT_GIT_DEFAULT_BRANCH if set.
+
+        Usage:
+            git-sync [options]
+
+        Options:
+            --install       Install a post-checkout hook that runs git-sync
+            -f, --force     Replace an existing post-checkout hook
+            -p, --print     Print the post-checkout hook instead
+        """
+        if options["--print"]:
+            print(POST_CHECKOUT_HOOK, end="")
+            return
+
+        git_dir = find_git_dir(os.getcwd())
+        if options["--install"]:
+            hook_path = install_post_checkout_hook(git_dir, force=options["--force"])
+            console.print(f"Installed [green]{hook_path}[/green]")
+            return
+
+        branch = current_branch(git_dir)
+        if branch is None:
+            console.print("Detached HEAD, nothing to do.")
+            return
+        is_default = branch in default_branches(git_dir)
+
+        if settings.JOURNAL and not settings.REMOTE:
+            self._journal(STOP if is_default else CREATE, "" if is_default else branch, console)
+            return
+
+        task = self._hunt().sync_branch(branch, is_default)
+        if task:
+            console.print(f"Working on [green]{task.name}[/green]")
+        else:
+            console.print(f"On [yellow]{branch}[/yellow], not working on anything.")
+
+    def backup(self, options, console):
+        """
+        Snapshot the database into the backups directory, keeping the newest few.
+
+        init and edit take a snapshot on their own before changing anything.
+
+        Usage:
+            backup [options]
+
+        Options:
+            -k, --keep=N        Number of snapshots to keep (default: HUNT_BACKUP_KEEP or 10)
+            -l, --list          List snapshots instead of taking one
+        """
+        if options["--list"]:
+            for snapshot in list_snapshots(settings.DATABASE):
+                console.print(snapshot)
+            return
+
+        keep = int(options["--keep"]) if options["--keep"] else None
+        snapshot = self._hunt().backup(keep=keep)
+        console.print(f"Backed up to [green]{snapshot}[/green]")
+
+    def log(self, options, console):
+        """
+        Show the work sessions within a time range (today by default).
+
+        Times are UTC, like all times hunt shows. TIME can be "now",
+        "2024-05-07 14:00", "2024-05-07", "14:00" (today), or "today",
+        "yesterday" or a weekday, optionally followed by a time of day
+        (e.g. "tuesday 14:00").
+
+        Usage:
+            log [options]
+
+        Options:
+            --since=TIME        Sessions going on at or after TIME
+            --until=TIME        Sessions going on before TIME
+            --at=TIME           Only what was being worked on at TIME
+        """
+        hunt = self._hunt(readonly=True)
+        current_time = now()
+        if options["--at"]:
+            since = parse_time(options["--at"], current_time)
+            until = since + 1
+        else:
+            since = parse_time(options["--since"] or "today", current_time)
+            until = parse_time(options["--until"], current_time) if options["--until"] else None
+
+        table = Table("NAME", "START", "STOP", "DURATION", box=box.MINIMAL_HEAVY_HEAD)
+        total = 0
+        for session in hunt.iter_sessions(since=since, until=until):
+            style = "green" if session.stop is None else None
+            table.add_row(
+                session.name,
+                session.get_start_display(),
+                session.get_stop_display(),
+                display_progress(session.duration()),
+                style=style,
+            )
+            if not options["--at"]:
+                total += session.duration(since=since, until=until)
+        console.print(table)
+        if not options["--at"]:
+            console.print(f"Total in range: [yellow]{display_progress(total)}[/yellow]")
+
+    def check(self, options, console):
+        """
+        Check the whole database for orphaned history, unpaired starts/stops,
+        overlapping sessions and task statuses that don't match the history.
+
+        Pending journal events are only folded in after a --fix, since
+        they may not apply to the broken database.
+
+        Usage:
+            check [options]
+
+        Options:
+            --fix       Repair the problems found (a backup is taken first)
+        """
+        hunt = self._hunt(fold=False)
+        problems = hunt.check()
+        if not problems:
+            console.print("[green]No problems found.[/green]")
+            if options["--fix"] and hunt.has_pending_events():
+                hunt.fold_journal()
+            return
+
+        table = Table("PROBLEM", "DETAILS", box=box.MINIMAL_HEAVY_HEAD)
+        for problem in problems:
+            table.add_row(problem.kind, problem.message)
+        console.print(table)
+
+        if options["--fix"]:
+            hunt.backup(label="check")
+            # Checked again under the write lock, as a hook may have written since
+            problems = hunt.check(fix=True)
+            fixed = [problem for problem in problems if problem.fixable]
+            console.print(f"Fixed [green]{len(fixed)}[/green] problems.")
+            for problem in problems:
+                if not problem.fixable:
+                    console.print(f"[yellow]Not fixed[/yellow]: {problem}")
+            if hunt.has_pending_events():
+                hunt.fold_journal()
+
+    def serve(self, options, console):
+        """
+        Serve an HTTP/JSON API over hunt, with a database per user, for a team
+        to track time in one place. Point HUNT_REMOTE at it to use it from the
+        CLI (as HUNT_REMOTE_USER, or your login name).
+
+        Usage:
+            serve [options]
+
+        Options:
+            -H, --host=HOST             Address to listen on [default: 127.0.0.1]
+            -p, --port=PORT             Port to listen on [default: 8421]
+            -d, --directory=DIRECTORY   Where the databases go (default: serve/ in the
+                                        hunt directory)
+        """
+        # Imported here since asyncio would slow down every other command's startup
+        import asyncio
+        from .server import serve
+
+        def ready(port):
+            console.print(f"Serving hunt on [green]http://{options['--host']}:{port}[/green]")
+
+        try:
+            asyncio.run(
+                serve(
+                    options["--host"],
+                    int(options["--port"]),
+                    directory=options["--directory"],
+                    ready=ready,
+                )
+            )
+        except KeyboardInterrupt:
+            console.print("Stopped")
+
 
 def main():
-    dispatcher = Dispatcher(Command(), {"options_first": True, "version": "0.0.0"})
+    dispatcher = Dispatcher(
+        Command(),
+        {"options_first": True, "version": __version__},
+        cache_path=settings.COMMAND_CACHE,
+        cache_key=(__version__, os.stat(__file__).st_mtime_ns),
+    )
 
-    options, handler, command_options = dispatcher.parse(sys.argv[1:])
+    try:
+        options, handler, command_options = dispatcher.parse(sys.argv[1:])
+    except (AmbiguousCommand, NoSuchCommand) as error:
+        Console().print(f"[red]Error[/red]: {error}")
+        sys.exit(1)
 
     if command_options["--silent"]:
         console = Console(file=StringIO())
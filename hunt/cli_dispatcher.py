@@ -1,55 +1,167 @@
 """
 Based on docker-compose.
+
+Parsing docstrings with docopt is the slowest part of a hunt invocation, so
+the usage patterns of every command are compiled once into a CommandTable,
+which is pickled to disk and reused until the package changes.
 """
+import os
+import pickle
+import tempfile
 from inspect import getdoc
 
-from docopt import docopt
+from docopt import AnyOptions
+from docopt import Dict
 from docopt import DocoptExit
+from docopt import Option
+from docopt import TokenStream
+from docopt import extras
+from docopt import formal_usage
+from docopt import parse_argv
+from docopt import parse_defaults
+from docopt import parse_pattern
+from docopt import printable_usage
+
+# Marks a prefix shared by several commands (never a valid attribute name)
+AMBIGUOUS = '<ambiguous>'
 
 
 class Dispatcher:
-    def __init__(self, command, options):
+    def __init__(self, command, options, cache_path=None, cache_key=None):
         self.command = command
         self.options = options
+        self.cache_path = cache_path
+        self.cache_key = cache_key
+        self._table = None
+
+    @property
+    def table(self):
+        if self._table is None:
+            self._table = self.load_table()
+        return self._table
+
+    def load_table(self):
+        if self.cache_path:
+            try:
+                with open(self.cache_path, 'rb') as cache_file:
+                    cache_key, table = pickle.load(cache_file)
+                if cache_key == self.cache_key:
+                    return table
+            except Exception:
+                pass
+
+        table = CommandTable(self.command)
+        if self.cache_path and os.path.isdir(os.path.dirname(self.cache_path)):
+            self.save_table(table)
+        return table
+
+    def save_table(self, table):
+        cache_dir = os.path.dirname(self.cache_path)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as tmp_file:
+                pickle.dump((self.cache_key, table), tmp_file)
+            os.replace(tmp_path, self.cache_path)
+        except OSError:
+            pass
 
     def parse(self, argv):
-        command_doc = getdoc(self.command)
-        command_options = _docopt(command_doc, argv, **self.options)
+        table = self.table
+        command_options = _docopt(table.usage, argv, **self.options)
         sub_command = command_options['COMMAND']
 
         if sub_command is None:
-            raise SystemExit(command_doc)
-
-        command_attrs = filter(
-            lambda a: not a.startswith('__'), dir(self.command))
-        sub_command_name = None
-        for attr in command_attrs:
-            if attr.startswith(sub_command.replace('-', '_')):
-                if sub_command_name:
-                    raise AmbiguousCommand(sub_command, self)
-                sub_command_name = attr
-
-        if not sub_command_name:
-            raise NoSuchCommand(sub_command, self)
-
-        sub_command_handler = getattr(self.command, sub_command_name)
-        sub_command_doc = getdoc(sub_command_handler)
+            raise SystemExit(table.usage.doc)
 
-        if sub_command_doc is None:
+        sub_command_name = table.resolve(sub_command)
+        if sub_command_name is None:
             raise NoSuchCommand(sub_command, self)
+        if sub_command_name == AMBIGUOUS:
+            raise AmbiguousCommand(sub_command, self, table.candidates(sub_command))
 
+        sub_command_handler = getattr(self.command, sub_command_name)
         sub_command_options = _docopt(
-            sub_command_doc,
+            table.commands[sub_command_name],
             command_options['ARGS'],
         )
         return sub_command_options, sub_command_handler, command_options
 
 
-def _docopt(doc, *args, **kwargs):
+class CommandTable:
+    """
+    Compiled usage patterns for a command and all its sub commands, plus a
+    prefix lookup table so that `hunt wo` resolves to `workon` with one dict
+    lookup. The command's `_prefixes` (prefix -> sub command) keep prefixes
+    working that later sub commands would make ambiguous.
+    """
+
+    def __init__(self, command):
+        self.usage = Usage(getdoc(command))
+        self.commands = {}
+        for attr in dir(command):
+            if attr.startswith('_') or not callable(getattr(command, attr)):
+                continue
+            doc = getdoc(getattr(command, attr))
+            if doc is not None:
+                self.commands[attr] = Usage(doc)
+
+        self.prefixes = {}
+        for name in self.commands:
+            for end in range(1, len(name) + 1):
+                prefix = name[:end]
+                if self.prefixes.get(prefix, name) != name:
+                    self.prefixes[prefix] = AMBIGUOUS
+                else:
+                    self.prefixes[prefix] = name
+        self.prefixes.update(getattr(command, '_prefixes', {}))
+
+    def resolve(self, sub_command):
+        name = sub_command.replace('-', '_')
+        if name in self.commands:
+            return name
+        return self.prefixes.get(name)
+
+    def candidates(self, sub_command):
+        """The commands starting with sub_command, as typed on the command line."""
+        name = sub_command.replace('-', '_')
+        return sorted(
+            command.replace('_', '-') for command in self.commands if command.startswith(name)
+        )
+
+
+class Usage:
+    """
+    A docopt docstring parsed ahead of time.
+
+    Equivalent to calling docopt(doc, ...) except the docstring is only
+    parsed once, in __init__.
+    """
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.printable_usage = printable_usage(doc)
+        self.options = parse_defaults(doc)
+        self.pattern = parse_pattern(formal_usage(self.printable_usage), self.options)
+        pattern_options = set(self.pattern.flat(Option))
+        for any_options in self.pattern.flat(AnyOptions):
+            any_options.children = list(set(parse_defaults(doc)) - pattern_options)
+        self.pattern = self.pattern.fix()
+
+    def parse(self, argv, help=True, version=None, options_first=False):
+        DocoptExit.usage = self.printable_usage
+        argv = parse_argv(TokenStream(argv, DocoptExit), list(self.options), options_first)
+        extras(help, version, argv, self.doc)
+        matched, left, collected = self.pattern.match(argv)
+        if matched and left == []:
+            return Dict((a.name, a.value) for a in (self.pattern.flat() + collected))
+        raise DocoptExit()
+
+
+def _docopt(usage, *args, **kwargs):
     try:
-        return docopt(doc, *args, **kwargs)
+        return usage.parse(*args, **kwargs)
     except DocoptExit:
-        raise SystemExit(doc)
+        raise SystemExit(usage.doc)
 
 
 class NoSuchCommand(Exception):
@@ -61,9 +173,10 @@ class NoSuchCommand(Exception):
 
 
 class AmbiguousCommand(Exception):
-    def __init__(self, command, supercommand):
+    def __init__(self, command, supercommand, candidates=()):
         super(AmbiguousCommand, self).__init__(
-            "Ambiguous command: %s" % command)
+            "Ambiguous command: %s (could be %s)" % (command, ", ".join(candidates)))
 
         self.command = command
         self.supercommand = supercommand
+        self.candidates = candidates
@@ -0,0 +1,87 @@
+"""
+Shell completion for hunt.
+
+Completing a task identifier must not start Python, so the scripts only read
+a small cache file (one open task name or id per line) that Hunt rewrites
+whenever the set of open tasks changes.
+"""
+import os
+import tempfile
+
+SHELLS = ('bash', 'zsh', 'fish')
+
+# Commands whose first argument is a <task-identifier>
+TASK_COMMANDS = ('show', 'workon', 'finish', 'restart', 'edit', 'rm')
+
+CACHE_PATH = '${HUNT_DIRECTORY:-$HOME/.hunt}/${DATABASE_NAME:-database.db}.completion'
+
+BASH = r"""_hunt() {
+    local cur=${COMP_WORDS[COMP_CWORD]} command="" i
+    local cache="%(cache)s"
+    for ((i = 1; i < COMP_CWORD; i++)); do
+        if [[ ${COMP_WORDS[i]} != -* ]]; then
+            command=${COMP_WORDS[i]}
+            break
+        fi
+    done
+    if [[ -z $command ]]; then
+        COMPREPLY=($(compgen -W "%(commands)s" -- "$cur"))
+    elif [[ " %(task_commands)s " == *" $command "* && $cur != -* && -r $cache ]]; then
+        local IFS=$'\n'
+        COMPREPLY=($(compgen -W "$(< "$cache")" -- "$cur"))
+    fi
+}
+complete -F _hunt hunt
+"""
+
+ZSH = r"""#compdef hunt
+_hunt() {
+    local cache="%(cache)s" command="" word
+    for word in ${words[2,CURRENT-1]}; do
+        if [[ $word != -* ]]; then
+            command=$word
+            break
+        fi
+    done
+    if [[ -z $command ]]; then
+        compadd -- %(commands)s
+    elif [[ " %(task_commands)s " == *" $command "* && $PREFIX != -* && -r $cache ]]; then
+        compadd -- ${(f)"$(<$cache)"}
+    fi
+}
+compdef _hunt hunt
+"""
+
+FISH = r"""function __hunt_task_identifiers
+    set -l dir $HUNT_DIRECTORY
+    test -n "$dir"; or set dir $HOME/.hunt
+    set -l database $DATABASE_NAME
+    test -n "$database"; or set database database.db
+    test -r $dir/$database.completion; and string match -- '*' < $dir/$database.completion
+end
+complete -c hunt -f -n '__fish_use_subcommand' -a '%(commands)s'
+complete -c hunt -f -n '__fish_seen_subcommand_from %(task_commands)s' -a '(__hunt_task_identifiers)'
+"""
+
+SCRIPTS = {'bash': BASH, 'zsh': ZSH, 'fish': FISH}
+
+
+def completion_script(shell, commands):
+    return SCRIPTS[shell] % {
+        'cache': CACHE_PATH,
+        'commands': ' '.join(commands),
+        'task_commands': ' '.join(TASK_COMMANDS),
+    }
+
+
+def completion_cache_path(database):
+    return database + '.completion'
+
+
+def write_completion_cache(path, tasks):
+    """Atomically replace the cache with the names, then ids, of `tasks`."""
+    lines = [task.name for task in tasks] + [str(task.id) for task in tasks]
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as tmp_file:
+        tmp_file.write(''.join(line + '\n' for line in lines))
+    os.replace(tmp_path, path)
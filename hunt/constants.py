@@ -5,6 +5,7 @@ FINISHED = 'Finished'
 STATUSES = [CURRENT, IN_PROGRESS, TODO, FINISHED]
 TASKS_TABLE = 'tasks'
 HISTORY_TABLE = 'history'
+TAGS_TABLE = 'tags'
 
 
 class HuntError(Exception):
@@ -30,5 +31,10 @@ class HuntFoundMultipleTasksError(HuntError):
 class HuntTaskValidationError(HuntError):
     exit_status = 6
 
+
 class HuntNotInitializedError(HuntError):
     exit_status = 7
+
+
+class HuntInvalidTimeError(HuntError):
+    exit_status = 8
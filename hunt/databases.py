@@ -0,0 +1,68 @@
+"""
+Querying many hunt databases at once (e.g. one per client or project).
+
+Each database is read through its own read-only connection on a thread pool;
+sqlite3 releases the GIL while it runs a query, so an overview takes about as
+long as the slowest database rather than the sum of them all.
+"""
+import glob
+import heapq
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from hunt import settings
+from .hunt import Hunt
+from .storage import SQLiteStorage
+
+MAX_WORKERS = 16
+
+
+def database_paths(pattern):
+    """Databases matching a glob pattern (relative patterns are under HUNT_DIR)."""
+    pattern = os.path.join(settings.HUNT_DIR, os.path.expanduser(pattern))
+    return sorted(path for path in glob.glob(pattern) if os.path.isfile(path))
+
+
+def database_label(path):
+    label = os.path.relpath(path, settings.HUNT_DIR)
+    if label.startswith(os.pardir):
+        label = path
+    return os.path.splitext(label)[0]
+
+
+def map_databases(func, paths):
+    """func(hunt) for a read-only Hunt on each database, in the order of paths."""
+
+    def run(path):
+        return func(Hunt(storage=SQLiteStorage(path, readonly=True)))
+
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_WORKERS, len(paths)))) as pool:
+        return list(pool.map(run, paths))
+
+
+def list_tasks(paths, statuses=None, starts_with=None, contains=None, tags=None, any_tag=False):
+    """
+    (label, task, progress) for the matching tasks of every database, merged
+    into one list in the usual task order.
+    """
+
+    def tasks_with_progress(hunt):
+        tasks = hunt.get_tasks(
+            statuses, starts_with=starts_with, contains=contains, tags=tags, any_tag=any_tag
+        )
+        taskid2progress = hunt.get_progress_by_task([task.id for task in tasks])
+        return [(task, taskid2progress[task.id]) for task in tasks]
+
+    results = map_databases(tasks_with_progress, paths)
+    labelled = [
+        [(database_label(path), task, progress) for task, progress in rows]
+        for path, rows in zip(paths, results)
+    ]
+    # Task equality is by id, which isn't unique across databases
+    return list(heapq.merge(*labelled, key=lambda row: row[1].sort_key))
+
+
+def summarize(paths):
+    """(label, summary) for every database (see Hunt.get_summary)."""
+    summaries = map_databases(lambda hunt: hunt.get_summary(), paths)
+    return [(database_label(path), summary) for path, summary in zip(paths, summaries)]
@@ -0,0 +1,96 @@
+"""
+Just enough git to map the checked out branch to a task, without running git.
+
+Everything is read straight from the repository's files, so `hunt git-sync`
+from a post-checkout hook is one process instead of the alias shell chain.
+"""
+import os
+
+from hunt import settings
+from .constants import HuntError
+
+HOOK_MARKER = '# Installed by hunt'
+
+POST_CHECKOUT_HOOK = """#!/bin/sh
+%s: track time on the checked out branch.
+# Only branch checkouts ($3 = 1), in the background so checkout never waits.
+[ "$3" = "1" ] || exit 0
+command -v hunt >/dev/null 2>&1 || exit 0
+hunt --silent git-sync >/dev/null 2>&1 &
+exit 0
+""" % HOOK_MARKER
+
+
+def find_git_dir(path):
+    """
+    The git directory of the repository containing `path`. For a worktree,
+    that's its own directory under the main repository's .git/worktrees.
+    """
+    path = os.path.abspath(path)
+    while True:
+        dot_git = os.path.join(path, '.git')
+        if os.path.isdir(dot_git):
+            return dot_git
+        if os.path.isfile(dot_git):
+            with open(dot_git) as f:
+                content = f.read().strip()
+            if content.startswith('gitdir:'):
+                return os.path.normpath(os.path.join(path, content[len('gitdir:'):].strip()))
+        parent = os.path.dirname(path)
+        if parent == path:
+            raise HuntError("[red]Error[/red]: Not in a git repository")
+        path = parent
+
+
+def common_git_dir(git_dir):
+    """The git directory shared by all worktrees (refs, hooks, config)."""
+    commondir = os.path.join(git_dir, 'commondir')
+    if os.path.isfile(commondir):
+        with open(commondir) as f:
+            return os.path.normpath(os.path.join(git_dir, f.read().strip()))
+    return git_dir
+
+
+def read_symbolic_ref(path, prefix):
+    try:
+        with open(path) as f:
+            content = f.read().strip()
+    except OSError:
+        return None
+    if content.startswith('ref: ' + prefix):
+        return content[len('ref: ' + prefix):]
+    return None
+
+
+def current_branch(git_dir):
+    """The checked out branch, or None if HEAD is detached."""
+    return read_symbolic_ref(os.path.join(git_dir, 'HEAD'), 'refs/heads/')
+
+
+def default_branches(git_dir):
+    """Branches that mean "not working on a task"."""
+    if settings.GIT_DEFAULT_BRANCH:
+        return {settings.GIT_DEFAULT_BRANCH}
+    origin_head = read_symbolic_ref(
+        os.path.join(common_git_dir(git_dir), 'refs', 'remotes', 'origin', 'HEAD'),
+        'refs/remotes/origin/',
+    )
+    if origin_head:
+        return {origin_head}
+    return {'main', 'master'}
+
+
+def install_post_checkout_hook(git_dir, force=False):
+    hooks_dir = os.path.join(common_git_dir(git_dir), 'hooks')
+    hook_path = os.path.join(hooks_dir, 'post-checkout')
+    if os.path.exists(hook_path) and not force:
+        with open(hook_path) as f:
+            if HOOK_MARKER not in f.read():
+                raise HuntError(
+                    f"[red]Error[/red]: {hook_path} already exists (use --force to replace it)"
+                )
+    os.makedirs(hooks_dir, exist_ok=True)
+    with open(hook_path, 'w') as f:
+        f.write(POST_CHECKOUT_HOOK)
+    os.chmod(hook_path, 0o755)
+    return hook_path
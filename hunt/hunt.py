@@ -1,13 +1,17 @@
-import sqlite3
 import time
+from collections import defaultdict
 from datetime import datetime
-from contextlib import contextmanager
 from functools import total_ordering
+from itertools import groupby
+from operator import attrgetter
 
 from hunt import settings
+from .backup import take_snapshot
+from .check import find_problems
+from .completion import completion_cache_path
+from .completion import write_completion_cache
 from .constants import CURRENT
 from .constants import FINISHED
-from .constants import HISTORY_TABLE
 from .constants import HuntAlreadyWorkingOnTaskError
 from .constants import HuntCouldNotFindTaskError
 from .constants import HuntFoundMultipleTasksError
@@ -15,11 +19,17 @@ from .constants import HuntNoCurrentTaskError
 from .constants import HuntNotInitializedError
 from .constants import IN_PROGRESS
 from .constants import STATUSES
-from .constants import TASKS_TABLE
 from .constants import TODO
+from .journal import fold_journal
+from .journal import has_pending_events
+from .journal import journal_path
+from .storage import MIGRATIONS
+from .storage import SQLiteStorage
 from .utils import calc_progress
-from .utils import needs_init
+from .utils import display_estimate
 from .utils import display_time
+from .utils import hunt_assert
+from .utils import needs_init
 
 
 def now():
@@ -27,41 +37,62 @@ def now():
 
 
 class Hunt:
-    def __init__(self, database=None):
-        if not database and needs_init():
+    def __init__(
+        self, database=None, storage=None, maintain_every=None, readonly=False, fold=True
+    ):
+        """
+        With readonly=True, the database is read through read-only connections
+        that never take a lock a writer waits on (after bringing it up to
+        date, if it has pending migrations or journal events).
+
+        With fold=False, pending journal events are left for later (e.g. until
+        `check` has repaired a database they can't be applied to).
+        """
+        if not database and not storage and needs_init():
             raise HuntNotInitializedError(
                 "[red]Error[/red]: Run [bold]hunt init[/bold] to initiliaze hunt database"
             )
-        if database:
-            self.database = database
+        if storage:
+            self.storage = storage
         else:
-            self.database = settings.DATABASE
+            self.storage = SQLiteStorage(database or settings.DATABASE, readonly=readonly)
+        self.database = self.storage.database
+        journal = self.database and journal_path(self.database)
+        if self.storage.readonly:
+            if self.database and (
+                self.storage.schema_version() < len(MIGRATIONS) or has_pending_events(journal)
+            ):
+                Hunt(database=self.database)
+            return
+        self.storage.migrate()
+        if maintain_every is None:
+            maintain_every = settings.MAINTAIN_EVERY
+        self.storage.maintain_every = maintain_every
+        if fold and journal and has_pending_events(journal):
+            self.fold_journal()
+
+    def transaction(self, immediate=False):
+        return self.storage.transaction(immediate=immediate)
+
+    def savepoint(self):
+        return self.storage.savepoint()
+
+    def fold_journal(self):
+        fold_journal(self, journal_path(self.database))
+
+    def has_pending_events(self):
+        return bool(self.database) and has_pending_events(journal_path(self.database))
 
     def get_task(self, task_identifier, statuses=None):
         if isinstance(task_identifier, int) or task_identifier.isdigit():
-            where_clause = "id=?"
-            order_by = "last_modified DESC"
-            params = [task_identifier]
+            tasks = self.storage.select_tasks(taskid=task_identifier, statuses=statuses)
         elif task_identifier == "$CURRENT":
-            where_clause = None
-            order_by = "last_modified DESC"
-            params = []
+            tasks = self.storage.select_tasks(statuses=statuses)
         elif task_identifier:
-            where_clause = "name LIKE ?"
-            order_by = "last_modified DESC"
-            params = [task_identifier + "%"]
+            tasks = self.storage.select_tasks(starts_with=task_identifier, statuses=statuses)
         else:
             raise AssertionError("No task identifier given.")
-
-        if statuses:
-            if where_clause:
-                where_clause += " AND status IN (" + ",".join(len(statuses) * "?") + ")"
-            else:
-                where_clause = "status IN (" + ",".join(len(statuses) * "?") + ")"
-
-            params.extend(statuses)
-
-        tasks = self.select_from_task(where_clause=where_clause, order_by=order_by, params=params)
+        tasks = list(map(Task, tasks))
 
         if len(tasks) == 0:
             raise HuntCouldNotFindTaskError(
@@ -76,9 +107,10 @@ class Hunt:
 
         return tasks[0]
 
-    def display_task(self, taskid):
+    def display_task(self, taskid, history=None):
+        """The task as edited in `hunt edit`, with only `history` if given."""
         task = self.get_task(str(taskid))
-        task_history = self.get_history(taskid)
+        task_history = self.get_history(taskid) if history is None else history
 
         lines = []
         lines.append("NAME: %s" % task.name)
@@ -92,47 +124,202 @@ class Hunt:
             lines.append(record_type + "\t" + history_record.get_time_display())
         return "\n".join(lines)
 
-    def create_task(self, name, estimate=None, description=None):
-        task = Task((None, name, estimate, description, TODO, now()))
-        self.insert_task(task)
-        return self.get_task(task.name, statuses=[TODO])
-
-    def get_tasks(self, statuses=None, starts_with=None, contains=None):
-        where_clause_param_tuples = []
-        if starts_with:
-            where_clause_param_tuples.append(("name LIKE ?", (starts_with + "%",)))
-        if contains:
-            where_clause_param_tuples.append(("name LIKE ?", ("%" + contains + "%",)))
-        if statuses:
-            where_clause_param_tuples.append(
-                ("status IN (" + ",".join(len(statuses) * "?") + ")", statuses)
+    def create_task(self, name, estimate=None, description=None, parent_id=None, tags=None):
+        task = Task((None, name, estimate, description, TODO, now(), parent_id))
+        with self.transaction():
+            task = self.get_task(self.insert_task(task))
+            if tags:
+                self.tag_task(task.id, tags)
+        self.update_completion_cache()
+        return task
+
+    def find_or_create_task(self, name, estimate=None, description=None):
+        """The open task called exactly `name` (the latest, if several), created if there's none."""
+        tasks = list(self.storage.select_tasks(name=name, statuses=[CURRENT, IN_PROGRESS, TODO]))
+        if tasks:
+            return Task(tasks[0])
+        return self.create_task(name, estimate=estimate, description=description)
+
+    def get_tasks(self, statuses=None, starts_with=None, contains=None, tags=None, any_tag=False):
+        """
+        Tasks matching all the filters, in the usual order. Tasks need all of
+        `tags`, or any of them with any_tag.
+        """
+        return list(
+            self.iter_tasks(
+                statuses, starts_with=starts_with, contains=contains, tags=tags, any_tag=any_tag
             )
-        if where_clause_param_tuples:
-            where_clauses, where_params = zip(*where_clause_param_tuples)
-            where_clause = " AND ".join(where_clauses)
-            params = [param for params in where_params for param in params]
-        else:
-            where_clause = None
-            params = None
+        )
 
-        tasks = self.select_from_task(where_clause=where_clause, params=params)
-        return sorted(tasks)
+    def iter_tasks(self, statuses=None, starts_with=None, contains=None, tags=None, any_tag=False):
+        """Like get_tasks, but yields tasks (already sorted) as they're read."""
+        tasks = self.storage.select_tasks(
+            starts_with=starts_with,
+            contains=contains,
+            statuses=statuses,
+            tags=tags,
+            any_tag=any_tag,
+            by_status=True,
+        )
+        return map(Task, tasks)
+
+    def get_tags_by_task(self, taskids):
+        """Sorted tags of each task."""
+        taskid2tags = defaultdict(list)
+        for taskid, tag in self.storage.select_tags(taskids):
+            taskid2tags[taskid].append(tag)
+        return taskid2tags
+
+    def tag_task(self, taskid, tags):
+        self.storage.insert_tags(taskid, tags)
+
+    def untag_task(self, taskid, tags):
+        self.storage.delete_tags(taskid, tags)
+
+    def get_task_tree(
+        self, root=None, statuses=None, starts_with=None, contains=None, tags=None, any_tag=False
+    ):
+        """
+        Subtrees of every task under `root` (or of all tasks), depth first.
+        With filters, only matching tasks and the tasks above them are kept;
+        rollups always count everything underneath.
+        """
+        subtrees = map(Subtree, self.storage.select_task_tree(now(), root=root))
+        if not (statuses or starts_with or contains or tags):
+            return list(subtrees)
+        tagged_ids = tags and {task.id for task in self.iter_tasks(tags=tags, any_tag=any_tag)}
+
+        def matches(task):
+            return (
+                (not statuses or task.status in statuses)
+                and (not starts_with or task.name.lower().startswith(starts_with.lower()))
+                and (not contains or contains.lower() in task.name.lower())
+                and (not tags or task.id in tagged_ids)
+            )
+
+        kept = []
+        ancestors = []  # (subtree, kept yet) for the path down to the current subtree
+        for subtree in subtrees:
+            del ancestors[subtree.depth:]
+            ancestors.append([subtree, False])
+            if matches(subtree.task):
+                for ancestor in ancestors:
+                    if not ancestor[1]:
+                        kept.append(ancestor[0])
+                        ancestor[1] = True
+        return kept
+
+    def set_parent(self, taskid, parent_id):
+        """Make a task a subtask of another (or, with parent_id None, of none)."""
+        if parent_id is not None:
+            hunt_assert(
+                parent_id != taskid and taskid not in self.storage.select_ancestor_ids(parent_id),
+                "A task can't be a subtask of itself or of one of its subtasks",
+            )
+        self.update_task(taskid, "parent_id", parent_id)
 
     def get_history(self, taskids):
         if isinstance(taskids, int):
             taskids = [taskids]
         assert all(map(lambda taskid: isinstance(taskid, int), taskids))
 
-        where_clause = "taskid IN (" + ",".join(len(taskids) * "?") + ")"
-        history = self.select_from_history(where_clause=where_clause, params=taskids)
-        return sorted(history)
+        return list(self.iter_history(taskids))
+
+    def get_history_window(self, taskid, last=None, since=None):
+        """
+        The record before and the records of a window at the end of a task's
+        history: its last `last` records, or those from time `since` on. The
+        window is widened to start with a Start, so it holds whole sessions.
+        """
+        window = list(map(History, self.storage.select_history_tail(taskid, last, since)))
+        before = window[0].time if window else None
+        earlier = list(map(History, self.storage.select_history_before(taskid, before, limit=2)))
+        if window and not window[0].is_start and earlier:
+            window.insert(0, earlier.pop(0))
+        preceding = earlier[0] if earlier else None
+        return preceding, window
+
+    def iter_history(self, taskids):
+        """Like get_history, but yields records (ordered by task then time) as they're read."""
+        if isinstance(taskids, int):
+            taskids = [taskids]
+        return map(History, self.storage.select_history(taskids))
+
+    def iter_sessions(self, since=None, until=None):
+        """
+        Work sessions overlapping the time range [since, until), in time
+        order, read lazily. Leave either end out for an open range.
+        """
+        return map(Session, self.storage.select_sessions(since=since, until=until))
+
+    def get_sessions_at(self, at):
+        """The sessions (normally just one) going on at time `at`."""
+        return list(self.iter_sessions(since=at, until=at + 1))
+
+    def get_progress_by_task(self, taskids):
+        """Progress (in seconds) of each task, streamed one task's history at a time."""
+        taskid2progress = defaultdict(int)
+        history_records = self.iter_history(taskids)
+        for taskid, task_history in groupby(history_records, key=attrgetter("taskid")):
+            taskid2progress[taskid] = calc_progress(task_history)
+        return taskid2progress
+
+    def get_summary(self):
+        """Task counts and estimates by status plus the total time tracked."""
+        status_rows, tracked = self.storage.summary(now())
+        counts = {status: 0 for status in STATUSES}
+        estimates = {status: 0 for status in STATUSES}
+        for status, count, estimate in status_rows:
+            counts[status] = count
+            estimates[status] = estimate or 0
+        return {"counts": counts, "estimates": estimates, "tracked": tracked}
+
+    def backup(self, label=None, keep=None):
+        """Take a rotating snapshot of the database; returns its path."""
+        return take_snapshot(self.storage, label=label, keep=keep)
+
+    def check(self, fix=False):
+        """
+        Find (and with fix=True, repair in one transaction) inconsistencies
+        across the whole database. Returns the problems found.
+
+        With fix=True the database is read under the write lock, so a write
+        landing in the meantime can't be "repaired" from a stale read.
+        """
+        if not fix:
+            return self.find_problems()
+        with self.transaction(immediate=True):
+            problems = self.find_problems()
+            for problem in problems:
+                if problem.delete:
+                    self.storage.delete_history(problem.delete.id)
+                if problem.insert:
+                    self.insert_history(History((None,) + problem.insert))
+                if problem.status:
+                    taskid, status = problem.status
+                    self.update_task(taskid, "status", status)
+        return problems
+
+    def find_problems(self):
+        tasks = {task.id: task for task in map(Task, self.storage.select_tasks())}
+        history = map(History, self.storage.select_history_by_time())
+        return find_problems(tasks, history)
+
+    def get_health(self):
+        return self.storage.health()
+
+    def maintain(self):
+        self.storage.maintain(analyze=True)
 
     def get_progress(self, taskid):
         history = self.get_history(taskid)
         return calc_progress(history)
 
+    def get_estimate_accuracy_rows(self):
+        return self.storage.estimate_accuracy_rows()
+
     def get_current_task(self, required=True):
-        current_tasks = self.select_from_task(where_clause="status IN (?)", params=(CURRENT,))
+        current_tasks = list(map(Task, self.storage.select_tasks(statuses=[CURRENT])))
         if len(current_tasks) == 0:
             if required:
                 raise HuntNoCurrentTaskError("No current tasks.")
@@ -143,7 +330,8 @@ class Hunt:
 
         return current_tasks[0]
 
-    def workon_task(self, task_identifier):
+    def workon_task(self, task_identifier, at=None):
+        at = at or now()
         task = self.get_task(task_identifier)
         current_task = self.get_current_task(required=False)
         if current_task:
@@ -151,85 +339,82 @@ class Hunt:
                 raise HuntAlreadyWorkingOnTaskError(
                     f"Already working on [yellow]{task.name}[/yellow]"
                 )
-            self.insert_history(History((None, current_task.id, False, now())))
+            self.insert_history(History((None, current_task.id, False, at)))
             self.update_task(current_task.id, "status", IN_PROGRESS)
-        self.insert_history(History((None, task.id, True, now())))
+        self.insert_history(History((None, task.id, True, at)))
         self.update_task(task.id, "status", CURRENT)
+        if task.status == FINISHED:
+            self.update_completion_cache()
+
+    def sync_branch(self, branch, is_default, at=None):
+        """
+        Track git: work on the branch's task (creating it if needed), or stop
+        working on the default branch. Returns the task now being worked on.
+        """
+        with self.transaction(immediate=True):
+            current_task = self.get_current_task(required=False)
+            if is_default:
+                if current_task:
+                    self.stop_current_task(at=at)
+                return None
+            task = self.find_or_create_task(branch)
+            if not current_task or current_task.id != task.id:
+                self.workon_task(task.id, at=at)
+            return task
 
-    def stop_current_task(self):
+    def stop_current_task(self, at=None):
         current_task = self.get_current_task()
-        self.insert_history(History((None, current_task.id, False, now())))
+        self.insert_history(History((None, current_task.id, False, at or now())))
         self.update_task(current_task.id, "status", IN_PROGRESS)
         return self.get_task(current_task.id)
 
     def finish_task(self, taskid):
         self.update_task(taskid, "status", FINISHED)
+        self.update_completion_cache()
 
     def estimate_task(self, taskid, estimate):
         self.update_task(taskid, "estimate", estimate)
 
+    def replace_task(self, taskid, task_dict, window=None):
+        """
+        Overwrite a task with an edited version (see parse_task), keeping its
+        id so its subtasks stay attached. If only a `window` of its history
+        was edited, the edited history replaces just those records.
+        """
+        with self.transaction(immediate=True):
+            for field in ("name", "estimate", "description", "status"):
+                self.storage.update_task(taskid, field, task_dict[field], now())
+            if window is None:
+                self.storage.delete_task_history(taskid)
+            else:
+                for history_record in window:
+                    self.storage.delete_history(history_record.id)
+            for is_start, history_time in task_dict["history"]:
+                self.insert_history(History((None, taskid, is_start, history_time)))
+        self.update_completion_cache()
+        return self.get_task(taskid)
+
     def remove_task(self, taskid):
-        delete_task_sql = "DELETE from {table} WHERE id=?".format(table=TASKS_TABLE)
-        delete_history_sql = "DELETE from {table} WHERE taskid=?".format(table=HISTORY_TABLE)
-        self.execute(delete_task_sql, (taskid,))
-        self.execute(delete_history_sql, (taskid,))
+        self.storage.delete_task(taskid)
+        self.update_completion_cache()
 
     def update_task(self, taskid, field, value):
-        sql = ("UPDATE {table} SET {field}=?, last_modified=? " "WHERE id=?").format(
-            table=TASKS_TABLE, field=field
-        )
-        self.execute(sql, (value, now(), taskid))
-
-    def select_from_task(self, where_clause=None, order_by=None, params=None):
-        return self.select_from_table(TASKS_TABLE, where_clause, order_by, params)
-
-    def select_from_history(self, where_clause=None, order_by=None, params=None):
-        return self.select_from_table(HISTORY_TABLE, where_clause, order_by, params)
-
-    def select_from_table(self, table, where_clause=None, order_by=None, params=None):
-        assert table in (TASKS_TABLE, HISTORY_TABLE)
-        sql = "SELECT * FROM {table}".format(table=table)
-        if where_clause:
-            sql += " WHERE " + where_clause
-        if order_by:
-            sql += " ORDER BY " + order_by
-        if table == TASKS_TABLE:
-            record_type = Task
-        elif table == HISTORY_TABLE:
-            record_type = History
-        else:
-            raise AssertionError(table + "is not one of the tables")
-        return list(map(record_type, self.execute(sql, params)))
+        self.storage.update_task(taskid, field, value, now())
+        if field == "name":
+            self.update_completion_cache()
+
+    def update_completion_cache(self):
+        """Rewrite the shell completion cache of open task names and ids."""
+        if not self.database:
+            return
+        tasks = self.get_tasks([CURRENT, IN_PROGRESS, TODO])
+        write_completion_cache(completion_cache_path(self.database), tasks)
 
     def insert_task(self, task):
-        sql = (
-            "INSERT INTO {table} "
-            "(name,estimate,description,status,last_modified) "
-            "VALUES (?,?,?,?,?)"
-        ).format(table=TASKS_TABLE)
-        self.execute(
-            sql, (task.name, task.estimate, task.description, task.status, task.last_modified)
-        )
+        return self.storage.insert_task(task)
 
     def insert_history(self, history):
-        sql = ("INSERT INTO {table} (taskid,is_start,time) VALUES " "(?,?,?)").format(
-            table=HISTORY_TABLE
-        )
-        self.execute(sql, (history.taskid, history.is_start, history.time))
-
-    def execute(self, sql, sql_params=None):
-        if sql_params is None:
-            sql_params = []
-        with self.connect() as conn:
-            rows = conn.execute(sql, sql_params).fetchall()
-        return rows
-
-    @contextmanager
-    def connect(self):
-        conn = sqlite3.connect(self.database)
-        yield conn
-        conn.commit()
-        conn.close()
+        self.storage.insert_history(history)
 
 
 @total_ordering
@@ -241,6 +426,8 @@ class Task(object):
         self.description = record[3]
         self.status = record[4]
         self.last_modified = record[5]
+        # Databases from before subtasks don't have the column
+        self.parent_id = record[6] if len(record) > 6 else None
 
     @property
     def last_modified_display(self):
@@ -248,12 +435,7 @@ class Task(object):
 
     @property
     def estimate_display(self):
-        estimate_display_str = ""
-        if self.estimate is not None:
-            estimate_display_str = "%d hr" % self.estimate
-            if self.estimate > 1:
-                estimate_display_str += "s"
-        return estimate_display_str
+        return display_estimate(self.estimate)
 
     def __str__(self):
         return "{name} ({status}): {desc}".format(
@@ -263,11 +445,12 @@ class Task(object):
     def __repr__(self):
         return str(self)
 
+    @property
+    def sort_key(self):
+        return (STATUSES.index(self.status), -self.last_modified)
+
     def __lt__(self, other):
-        return (STATUSES.index(self.status), -self.last_modified) < (
-            STATUSES.index(other.status),
-            -other.last_modified,
-        )
+        return self.sort_key < other.sort_key
 
     def __eq__(self, other):
         return self.id == other.id
@@ -309,3 +492,57 @@ class History(object):
 
     def __ne__(self, other):
         return self.id != other.id
+
+
+class Subtree(object):
+    """A task with the progress and estimates of everything under it rolled up."""
+
+    def __init__(self, record):
+        self.task = Task(record[:7])
+        self.depth = record[7]
+        self.progress = record[8]
+        self.total_progress = record[9]
+        self.total_estimate = record[10]
+        self.subtasks = record[11]
+
+    @property
+    def total_estimate_display(self):
+        return display_estimate(self.total_estimate)
+
+    def __str__(self):
+        return "{task} with {subtasks} subtasks".format(task=self.task, subtasks=self.subtasks)
+
+    def __repr__(self):
+        return str(self)
+
+
+class Session(object):
+    """A Start and the Stop that follows it."""
+
+    def __init__(self, record):
+        self.taskid = record[0]
+        self.name = record[1]
+        self.start = record[2]
+        self.stop = record[3]
+
+    def duration(self, since=None, until=None):
+        """Seconds worked, only counting the part within [since, until)."""
+        start = self.start if since is None else max(self.start, since)
+        stop = now() if self.stop is None else self.stop
+        if until is not None:
+            stop = min(stop, until)
+        return max(stop - start, 0)
+
+    def get_start_display(self):
+        return display_time(self.start)
+
+    def get_stop_display(self):
+        return "" if self.stop is None else display_time(self.stop)
+
+    def __str__(self):
+        return "{name} from {start} to {stop}".format(
+            name=self.name, start=self.get_start_display(), stop=self.get_stop_display() or "now"
+        )
+
+    def __repr__(self):
+        return str(self)
@@ -0,0 +1,127 @@
+"""
+Append-only event journal for the git hook hot path.
+
+With HUNT_JOURNAL set, `workon` and `stop` don't open the database at all:
+they append one fixed-format line to <database>.events with a single
+O_APPEND write (atomic for lines this short, so no locking is needed).
+Hunt folds pending events into the database, in one transaction, before
+anything else reads or writes it.
+
+Line format: 10 digit epoch time, space, event type, space, task identifier.
+(A FOLD line, added while folding, has the fold's number in place of the time.)
+
+Events that fail with anything but a HuntError (which just means the event
+didn't apply, e.g. stopping with no current task) are moved to
+<database>.events.failed, so one bad event can't hold up the rest.
+"""
+import os
+
+from .constants import CURRENT
+from .constants import HuntError
+from .constants import IN_PROGRESS
+from .constants import TODO
+
+WORKON = 'W'
+CREATE = 'C'
+STOP = 'S'
+EVENTS = (WORKON, CREATE, STOP)
+FOLD = 'F'
+# meta key of the number of the last fold applied
+FOLDS = 'journal_folds'
+
+
+def journal_path(database):
+    return database + '.events'
+
+
+def folding_path(path):
+    return path + '.folding'
+
+
+def failed_path(path):
+    return path + '.failed'
+
+
+def has_pending_events(path):
+    """Events in the journal, or left behind by a fold that crashed."""
+    return os.path.exists(path) or os.path.exists(folding_path(path))
+
+
+def append_event(path, event, at, task_identifier=''):
+    assert event in EVENTS or event == FOLD
+    assert '\n' not in task_identifier
+    line = '%010d %s %s\n' % (at, event, task_identifier)
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode())
+    finally:
+        os.close(fd)
+
+
+def read_events(path):
+    with open(path, encoding='utf-8') as journal:
+        for line in journal:
+            # A line without a newline is an append that was cut short
+            if not line.endswith('\n') or len(line) < 13 or line[12] != ' ':
+                continue
+            yield int(line[:10]), line[11], line[13:-1]
+
+
+def fold_journal(hunt, path):
+    """
+    Apply pending events to the database and remove them from the journal.
+
+    The journal is renamed before it is read, so hooks keep appending to a
+    fresh file while it's folded. Each event is applied in a savepoint:
+    events that fail are undone and skipped, just like the --silent hook
+    call would have, and unexpected errors are set aside in the failed file.
+
+    Each fold is numbered by a FOLD line at the end of the folding file, and
+    the last applied number is stored in the same transaction as the events.
+    A leftover folding file (from a crash before it was removed) is only
+    applied if its number hasn't been, so no event is ever applied twice.
+    """
+    folding = folding_path(path)
+    # Holding the write lock means no other process is folding
+    with hunt.transaction(immediate=True):
+        if not os.path.exists(folding):
+            try:
+                os.replace(path, folding)
+            except FileNotFoundError:
+                return
+        events = list(read_events(folding))
+        folded = hunt.storage.select_meta(FOLDS) or 0
+        numbers = [at for at, event, _ in events if event == FOLD]
+        if not numbers:
+            number = folded + 1
+            append_event(folding, FOLD, number)
+        else:
+            number = numbers[-1]
+        if number > folded:
+            for at, event, task_identifier in events:
+                if event == FOLD:
+                    continue
+                try:
+                    with hunt.savepoint():
+                        apply_event(hunt, at, event, task_identifier)
+                except HuntError:
+                    pass
+                except Exception:
+                    append_event(failed_path(path), event, at, task_identifier)
+            hunt.storage.update_meta(FOLDS, number)
+    os.remove(folding)
+
+    # Events appended while folding
+    if os.path.exists(path):
+        fold_journal(hunt, path)
+
+
+def apply_event(hunt, at, event, task_identifier):
+    if event == STOP:
+        hunt.stop_current_task(at=at)
+        return
+    if event == CREATE:
+        task = hunt.find_or_create_task(task_identifier)
+    else:
+        task = hunt.get_task(task_identifier, statuses=[CURRENT, IN_PROGRESS, TODO])
+    hunt.workon_task(task.id, at=at)
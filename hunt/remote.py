@@ -0,0 +1,188 @@
+"""
+Client for `hunt serve`, used instead of a local database when HUNT_REMOTE is set.
+
+A request is a POST of {"args": [...], "kwargs": {...}} to /<user>/<operation>
+and the response is the JSON encoded result (or {"error": ..., "type": ...}).
+OPERATIONS is the list of Hunt methods the server exposes and how their
+results travel as JSON; it's shared by both ends.
+"""
+import json
+import select
+from collections import defaultdict
+from functools import partial
+from http.client import HTTPConnection
+from http.client import HTTPException
+from urllib.parse import quote
+from urllib.parse import urlsplit
+
+from hunt import constants
+from .constants import HuntError
+from .hunt import Subtree
+from .hunt import Task
+
+TIMEOUT = 30
+
+
+def task_record(task):
+    return [
+        task.id,
+        task.name,
+        task.estimate,
+        task.description,
+        task.status,
+        task.last_modified,
+        task.parent_id,
+    ]
+
+
+def subtree_record(subtree):
+    return task_record(subtree.task) + [
+        subtree.depth,
+        subtree.progress,
+        subtree.total_progress,
+        subtree.total_estimate,
+        subtree.subtasks,
+    ]
+
+
+def optional(convert):
+    return lambda value: None if value is None else convert(value)
+
+
+def each(convert):
+    return lambda values: [convert(value) for value in values]
+
+
+def by_taskid(default_factory=None):
+    # JSON object keys are always strings
+    return lambda value: defaultdict(
+        default_factory, {int(taskid): item for taskid, item in value.items()}
+    )
+
+
+def same(value):
+    return value
+
+
+class Operation(object):
+    def __init__(self, writes, encode=same, decode=same):
+        self.writes = writes
+        self.encode = encode
+        self.decode = decode
+
+
+OPERATIONS = {
+    "get_task": Operation(False, task_record, Task),
+    "get_current_task": Operation(False, optional(task_record), optional(Task)),
+    "get_tasks": Operation(False, each(task_record), each(Task)),
+    "get_task_tree": Operation(False, each(subtree_record), each(Subtree)),
+    "get_progress": Operation(False),
+    "get_progress_by_task": Operation(False, decode=by_taskid(int)),
+    "get_tags_by_task": Operation(False, decode=by_taskid(list)),
+    "get_summary": Operation(False),
+    "display_task": Operation(False),
+    "create_task": Operation(True, task_record, Task),
+    "find_or_create_task": Operation(True, task_record, Task),
+    "workon_task": Operation(True),
+    "stop_current_task": Operation(True, task_record, Task),
+    "finish_task": Operation(True),
+    "estimate_task": Operation(True),
+    "remove_task": Operation(True),
+    "set_parent": Operation(True),
+    "tag_task": Operation(True),
+    "untag_task": Operation(True),
+    "sync_branch": Operation(True, optional(task_record), optional(Task)),
+}
+
+
+def error_class(name):
+    """The HuntError subclass called `name` (HuntError itself if there's none)."""
+    cls = getattr(constants, name, None)
+    if isinstance(cls, type) and issubclass(cls, HuntError):
+        return cls
+    return HuntError
+
+
+class RemoteHunt(object):
+    """
+    Stands in for Hunt, running the operations in OPERATIONS on a `hunt serve`
+    server (one HTTP connection, kept alive between calls). Anything else
+    raises a HuntError.
+    """
+
+    def __init__(self, url, user, timeout=TIMEOUT):
+        parts = urlsplit(url)
+        if parts.scheme != "http" or not parts.hostname:
+            raise HuntError(f"[red]Error[/red]: HUNT_REMOTE must be an http:// URL, not {url}")
+        self.url = url
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip("/")
+        self.user = user
+        self.timeout = timeout
+        self.database = None
+        self.connection = None
+
+    def call(self, operation, *args, **kwargs):
+        path = "%s/%s/%s" % (self.prefix, quote(self.user, safe=""), operation)
+        # Sets (e.g. of statuses) go as lists
+        body = json.dumps({"args": args, "kwargs": kwargs}, default=list).encode()
+        status, payload = self.request(path, body, retry=not OPERATIONS[operation].writes)
+        if status != 200:
+            raise error_class(payload.get("type", ""))(payload.get("error", "Server error"))
+        return OPERATIONS[operation].decode(payload)
+
+    def request(self, path, body, retry=False):
+        """
+        POST body to path. A request that fails on a kept-alive connection is
+        sent again on a new one if it never got to the server, or (with
+        retry, for reads) whenever it failed; a write the server may have
+        applied is never sent twice.
+        """
+        if self.connection is not None and self.is_stale():
+            self.close()
+        reused = self.connection is not None
+        if self.connection is None:
+            self.connection = HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+        try:
+            self.connection.request("POST", path, body, {"Content-Type": "application/json"})
+        except (OSError, HTTPException) as error:
+            self.close()
+            if reused:
+                return self.request(path, body, retry=retry)
+            raise self.error(error)
+
+        try:
+            response = self.connection.getresponse()
+            return response.status, json.loads(response.read() or b"{}")
+        except (OSError, HTTPException, ValueError) as error:
+            self.close()
+            if reused and retry:
+                return self.request(path, body, retry=retry)
+            raise self.error(error)
+
+    def is_stale(self):
+        """Whether the server has closed the kept-alive connection (it never talks unasked)."""
+        sock = self.connection.sock
+        if sock is None:
+            return True
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable)
+
+    def error(self, error):
+        return HuntError(f"[red]Error[/red]: Could not talk to hunt server at {self.url}: {error}")
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name not in OPERATIONS:
+            raise HuntError(
+                "[red]Error[/red]: This command isn't available with a remote hunt (HUNT_REMOTE)"
+            )
+        return partial(self.call, name)
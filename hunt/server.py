@@ -0,0 +1,243 @@
+"""
+`hunt serve`: a small HTTP/JSON API over Hunt for a team sharing one server.
+
+Every user gets their own database under SERVE_DIR. Reads run on a pool of
+read-only connections (WAL means they never wait for the writer), while all
+writes to a database go through one queue, applied one at a time by a single
+writer connection, so writers never fight over SQLite's lock either. The
+blocking SQLite calls run on the event loop's thread pool.
+
+Only the standard library is used: asyncio streams and just enough HTTP/1.1
+(keep-alive, Content-Length bodies) for RemoteHunt and curl.
+"""
+import asyncio
+import json
+import os
+import re
+import traceback
+
+from hunt import settings
+from .constants import HuntError
+from .hunt import Hunt
+from .remote import OPERATIONS
+from .storage import PersistentStorage
+from .storage import SQLiteStorage
+
+# Read-only connections per database
+READERS = 4
+# Pending connections the listening socket queues up
+BACKLOG = 1024
+MAX_BODY = 1024 * 1024
+
+USER_PATTERN = re.compile(r"^[A-Za-z0-9_][A-Za-z0-9_.-]{0,63}$")
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class BadRequest(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def run_operation(hunt, operation, args, kwargs):
+    """Call a Hunt method and encode its result, in a worker thread."""
+    result = getattr(hunt, operation)(*args, **kwargs)
+    return OPERATIONS[operation].encode(result)
+
+
+class Database(object):
+    """One user's database: a pool of readers and a queue for the single writer."""
+
+    def __init__(self, path, readers=READERS):
+        self.path = path
+        self.reader_count = readers
+        self.readers = asyncio.Queue()
+        self.writes = asyncio.Queue()
+        self.writer = None
+        self.writer_task = None
+        self.lock = asyncio.Lock()
+
+    async def open(self):
+        async with self.lock:
+            if self.writer is not None:
+                return
+            loop = asyncio.get_running_loop()
+            self.writer, readers = await loop.run_in_executor(None, self.connect)
+            for reader in readers:
+                self.readers.put_nowait(reader)
+            self.writer_task = asyncio.create_task(self.write_loop())
+
+    def connect(self):
+        if not os.path.exists(self.path):
+            SQLiteStorage(self.path).create_schema()
+        # The writer migrates the database, so it's opened before the readers
+        writer = Hunt(storage=PersistentStorage(self.path))
+        readers = [
+            Hunt(storage=PersistentStorage(self.path, readonly=True))
+            for _ in range(self.reader_count)
+        ]
+        return writer, readers
+
+    async def run(self, operation, args, kwargs):
+        await self.open()
+        loop = asyncio.get_running_loop()
+        if OPERATIONS[operation].writes:
+            future = loop.create_future()
+            await self.writes.put((operation, args, kwargs, future))
+            return await future
+        reader = await self.readers.get()
+        try:
+            return await loop.run_in_executor(
+                None, run_operation, reader, operation, args, kwargs
+            )
+        finally:
+            self.readers.put_nowait(reader)
+
+    async def write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            operation, args, kwargs, future = await self.writes.get()
+            try:
+                result = await loop.run_in_executor(
+                    None, run_operation, self.writer, operation, args, kwargs
+                )
+            except Exception as error:
+                if not future.done():
+                    future.set_exception(error)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+    async def close(self):
+        if self.writer_task is not None:
+            self.writer_task.cancel()
+            try:
+                await self.writer_task
+            except asyncio.CancelledError:
+                pass
+        while not self.readers.empty():
+            self.readers.get_nowait().storage.close()
+        if self.writer is not None:
+            self.writer.storage.close()
+            self.writer = None
+
+
+class HuntServer(object):
+    def __init__(self, directory=None, readers=READERS):
+        self.directory = directory or settings.SERVE_DIR
+        self.reader_count = readers
+        self.databases = {}
+        self.server = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start listening; returns the port (useful with port 0)."""
+        os.makedirs(self.directory, exist_ok=True)
+        self.server = await asyncio.start_server(self.handle, host, port, backlog=BACKLOG)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        await self.server.serve_forever()
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        for database in self.databases.values():
+            await database.close()
+        self.databases = {}
+
+    def database(self, user):
+        if user not in self.databases:
+            path = os.path.join(self.directory, user + ".db")
+            self.databases[user] = Database(path, readers=self.reader_count)
+        return self.databases[user]
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY:
+                    await self.respond(writer, 413, {"error": "Request too large"})
+                    break
+                body = await reader.readexactly(length)
+
+                status, payload = await self.dispatch(method, path, body)
+                await self.respond(writer, status, payload)
+                if version != "HTTP/1.1" or headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass  # Client went away or sent garbage; just hang up
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, path, body):
+        try:
+            if method != "POST":
+                raise BadRequest(405, "Use POST")
+            user, operation = self.route(path)
+            try:
+                request = json.loads(body or b"{}")
+                args = list(request.get("args", []))
+                kwargs = dict(request.get("kwargs", {}))
+            except (ValueError, TypeError, AttributeError):
+                raise BadRequest(400, "Expected a JSON object with args and kwargs")
+            return 200, await self.database(user).run(operation, args, kwargs)
+        except BadRequest as error:
+            return error.status, {"error": str(error)}
+        except HuntError as error:
+            return 400, {"error": str(error), "type": type(error).__name__}
+        except TypeError as error:
+            return 400, {"error": "Bad arguments: %s" % error}
+        except Exception:
+            traceback.print_exc()
+            return 500, {"error": "Internal server error"}
+
+    def route(self, path):
+        parts = path.split("?", 1)[0].strip("/").split("/")
+        if len(parts) != 2:
+            raise BadRequest(404, "Expected /<user>/<operation>")
+        user, operation = parts
+        if not USER_PATTERN.match(user):
+            raise BadRequest(404, "Bad user name: %s" % user)
+        if operation not in OPERATIONS:
+            raise BadRequest(404, "No such operation: %s" % operation)
+        return user, operation
+
+    async def respond(self, writer, status, payload):
+        body = json.dumps(payload).encode()
+        writer.write(
+            b"HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n"
+            % (status, REASONS[status].encode(), len(body))
+        )
+        writer.write(body)
+        await writer.drain()
+
+
+async def serve(host, port, directory=None, ready=None):
+    """Run a HuntServer until cancelled; ready(port) is called once it listens."""
+    server = HuntServer(directory)
+    port = await server.start(host, port)
+    if ready:
+        ready(port)
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
@@ -6,3 +6,20 @@ HUNT_DIR = path.expanduser(environ.get('HUNT_DIRECTORY', '~/.hunt'))
 DATABASE = path.join(
     HUNT_DIR, environ.get('DATABASE_NAME', 'database.db'))
 EDITOR = environ.get('EDITOR', 'vim')
+COMMAND_CACHE = path.join(HUNT_DIR, 'commands.cache')
+# Log workon/stop to an append-only journal instead of the database
+JOURNAL = bool(environ.get('HUNT_JOURNAL'))
+# Vacuum/optimize the database after this many writes (0 to never do it automatically)
+MAINTAIN_EVERY = int(environ.get('HUNT_MAINTAIN_EVERY', 500))
+# Branch that stops work in git-sync (defaults to origin's HEAD, else main/master)
+GIT_DEFAULT_BRANCH = environ.get('HUNT_GIT_DEFAULT_BRANCH')
+BACKUP_DIR = path.join(HUNT_DIR, 'backups')
+# Number of snapshots kept per database
+BACKUP_KEEP = int(environ.get('HUNT_BACKUP_KEEP', 10))
+# Bytes of the database read through a memory map by read-only commands (0 disables)
+MMAP_SIZE = int(environ.get('HUNT_MMAP_SIZE', 64 * 1024 * 1024))
+# Databases of `hunt serve`, one per user
+SERVE_DIR = path.join(HUNT_DIR, 'serve')
+# URL of a `hunt serve` server to use instead of the local database
+REMOTE = environ.get('HUNT_REMOTE')
+REMOTE_USER = environ.get('HUNT_REMOTE_USER') or environ.get('USER', 'default')
@@ -0,0 +1,115 @@
+"""
+Estimate accuracy analytics over finished tasks.
+
+Everything here works on columnar arrays (one array per column) that are
+built from a single aggregated query, so thousands of finished tasks cost one
+round trip to the database and one pass in Python.
+"""
+from array import array
+
+PERCENTILES = (10, 25, 50, 75, 90)
+
+# Upper bounds (in hours, inclusive) of the estimate size buckets
+ESTIMATE_BUCKETS = (1, 2, 4, 8, 16, 40)
+
+
+def build_columns(rows):
+    """Turn (taskid, estimate, actual_seconds, finished_time) rows into columns."""
+    taskids = array('q')
+    estimates = array('d')
+    actuals = array('d')
+    finished = array('q')
+    for taskid, estimate, actual_seconds, finished_time in rows:
+        taskids.append(taskid)
+        estimates.append(estimate)
+        actuals.append(actual_seconds / 3600.0)
+        finished.append(finished_time)
+    return taskids, estimates, actuals, finished
+
+
+def bucket_label(index):
+    if index == len(ESTIMATE_BUCKETS):
+        return "> %d hrs" % ESTIMATE_BUCKETS[-1]
+    upper = ESTIMATE_BUCKETS[index]
+    lower = ESTIMATE_BUCKETS[index - 1] + 1 if index else 1
+    if lower >= upper:
+        return "%d hr%s" % (upper, "s" if upper > 1 else "")
+    return "%d-%d hrs" % (lower, upper)
+
+
+def bucket_index(estimate):
+    for index, upper in enumerate(ESTIMATE_BUCKETS):
+        if estimate <= upper:
+            return index
+    return len(ESTIMATE_BUCKETS)
+
+
+def percentile(sorted_values, pct):
+    """Linearly interpolated percentile of an already sorted sequence."""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * pct / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    fraction = position - lower
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * fraction
+
+
+def estimate_accuracy(columns, window=20):
+    """
+    Compute actual/estimate ratios, their percentiles, the bias per estimate
+    size and a rolling trend ordered by finish time.
+
+    `columns` must be ordered by finish time (see Hunt.get_estimate_accuracy_rows).
+    A ratio above 1 means the task took longer than estimated.
+    """
+    taskids, estimates, actuals, finished = columns
+    count = len(taskids)
+    window = max(1, window)
+    step = max(1, count // 10)
+
+    ratios = array('d')
+    bucket_counts = [0] * (len(ESTIMATE_BUCKETS) + 1)
+    bucket_estimated = [0.0] * (len(ESTIMATE_BUCKETS) + 1)
+    bucket_actual = [0.0] * (len(ESTIMATE_BUCKETS) + 1)
+    bucket_ratios = [0.0] * (len(ESTIMATE_BUCKETS) + 1)
+    trend = []
+    window_sum = 0.0
+    for i in range(count):
+        ratio = actuals[i] / estimates[i]
+        ratios.append(ratio)
+
+        index = bucket_index(estimates[i])
+        bucket_counts[index] += 1
+        bucket_estimated[index] += estimates[i]
+        bucket_actual[index] += actuals[i]
+        bucket_ratios[index] += ratio
+
+        window_sum += ratio
+        if i >= window:
+            window_sum -= ratios[i - window]
+        if i + 1 >= window and ((count - 1 - i) % step == 0):
+            trend.append((finished[i], window_sum / window))
+
+    sorted_ratios = sorted(ratios)
+    buckets = []
+    for index, bucket_count in enumerate(bucket_counts):
+        if not bucket_count:
+            continue
+        buckets.append({
+            "label": bucket_label(index),
+            "count": bucket_count,
+            "mean_ratio": bucket_ratios[index] / bucket_count,
+            "estimated": bucket_estimated[index],
+            "actual": bucket_actual[index],
+        })
+
+    return {
+        "count": count,
+        "total_estimated": sum(estimates),
+        "total_actual": sum(actuals),
+        "percentiles": [(pct, percentile(sorted_ratios, pct)) for pct in PERCENTILES],
+        "buckets": buckets,
+        "trend": trend,
+        "window": window,
+    }
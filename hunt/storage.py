@@ -0,0 +1,839 @@
+"""
+Storage backends for Hunt.
+
+Hunt only talks to a Storage; all SQL lives here. SQLiteStorage is the
+on-disk database under HUNT_DIR and MemoryStorage keeps everything in an
+in-memory SQLite database that disappears with the object (for tests and
+benchmarks).
+"""
+import sqlite3
+from abc import ABC
+from abc import abstractmethod
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+from hunt import settings
+from .constants import FINISHED
+from .constants import HISTORY_TABLE
+from .constants import STATUSES
+from .constants import TAGS_TABLE
+from .constants import TASKS_TABLE
+
+# Rows fetched from a cursor at a time, which bounds memory for big queries
+BATCH_SIZE = 500
+
+# Pages copied per step of an online backup; the database is free between steps
+BACKUP_PAGES = 64
+
+# Each migration is a list of statements; PRAGMA user_version counts those applied
+MIGRATIONS = [
+    [
+        "CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY, value INTEGER)",
+        "INSERT OR IGNORE INTO meta(key, value) VALUES ('writes', 0)",
+        "CREATE INDEX IF NOT EXISTS history_taskid_time ON {history}(taskid, time)".format(
+            history=HISTORY_TABLE
+        ),
+    ],
+    [
+        "CREATE INDEX IF NOT EXISTS history_time ON {history}(time)".format(history=HISTORY_TABLE),
+    ],
+    [
+        "ALTER TABLE {tasks} ADD COLUMN parent_id INTEGER".format(tasks=TASKS_TABLE),
+        "CREATE INDEX IF NOT EXISTS tasks_parent_id ON {tasks}(parent_id)".format(tasks=TASKS_TABLE),
+    ],
+    [
+        # Keyed by tag first, so a tag's tasks are one range of the table
+        "CREATE TABLE IF NOT EXISTS {tags}(tag TEXT NOT NULL, task_id INTEGER NOT NULL, "
+        "PRIMARY KEY (tag, task_id)) WITHOUT ROWID".format(tags=TAGS_TABLE),
+        "CREATE INDEX IF NOT EXISTS tags_task_id ON {tags}(task_id)".format(tags=TAGS_TABLE),
+    ],
+    # Switch to WAL, so readers and the writer never block each other. The
+    # journal mode can't change inside a transaction, so migrate() does it.
+    [],
+]
+
+# Representative queries whose plans `hunt maintain` reports
+QUERY_PLANS = [
+    ("history of a task", "SELECT * FROM {history} WHERE taskid IN (?) ORDER BY taskid, time"),
+    ("history by time", "SELECT * FROM {history} WHERE time >= ? ORDER BY time"),
+    ("tasks by status", "SELECT * FROM {tasks} WHERE status IN (?)"),
+    ("tasks by name", "SELECT * FROM {tasks} WHERE name LIKE ?"),
+    ("subtasks", "SELECT * FROM {tasks} WHERE parent_id = ?"),
+    ("tasks by tag", "SELECT * FROM {tasks} WHERE id IN (SELECT task_id FROM {tags} WHERE tag = ?)"),
+]
+
+# Same order as sorting Task objects: by status, then most recently modified
+TASK_ORDER = "CASE status {whens} END, last_modified DESC".format(
+    whens=" ".join("WHEN '%s' THEN %d" % (status, i) for i, status in enumerate(STATUSES))
+)
+
+# Every task under the roots (depth first, siblings in creation order) with its
+# own progress and the progress, estimate and number of tasks of its subtree.
+# `closure` pairs each task with itself and all its descendants, so the rollup
+# is a single GROUP BY however deep the tree goes. Paths guard against cycles.
+TASK_TREE_SQL = """
+WITH RECURSIVE
+tree(id, depth, path) AS (
+    SELECT id, 0, printf('/%010d', id) FROM {tasks} WHERE {roots}
+    UNION ALL
+    SELECT t.id, tree.depth + 1, tree.path || printf('/%010d', t.id)
+    FROM {tasks} t JOIN tree ON t.parent_id = tree.id
+    WHERE instr(tree.path, printf('/%010d', t.id)) = 0
+),
+closure(ancestor, descendant) AS (
+    SELECT id, id FROM tree
+    UNION
+    SELECT closure.ancestor, t.id FROM closure JOIN {tasks} t ON t.parent_id = closure.descendant
+),
+progress(taskid, seconds) AS (
+    SELECT taskid, SUM(CASE WHEN is_start THEN ? - time ELSE time - ? END) FROM {history}
+    WHERE taskid IN (SELECT id FROM tree) GROUP BY taskid
+),
+rollup(id, seconds, estimate, subtasks) AS (
+    SELECT closure.ancestor, SUM(COALESCE(progress.seconds, 0)), SUM(t.estimate), COUNT(*) - 1
+    FROM closure JOIN {tasks} t ON t.id = closure.descendant
+    LEFT JOIN progress ON progress.taskid = closure.descendant
+    GROUP BY closure.ancestor
+)
+SELECT t.id, t.name, t.estimate, t.description, t.status, t.last_modified, t.parent_id,
+    tree.depth, COALESCE(progress.seconds, 0), rollup.seconds, rollup.estimate, rollup.subtasks
+FROM tree JOIN {tasks} t ON t.id = tree.id
+JOIN rollup ON rollup.id = tree.id
+LEFT JOIN progress ON progress.taskid = tree.id
+ORDER BY tree.path
+"""
+
+
+def escape_like(text):
+    """`text` with LIKE's wildcards (and the escape character) escaped by a backslash."""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class Storage(ABC):
+    """
+    Interface of a storage backend. Every method is abstract, so a backend
+    missing one fails when it's constructed rather than in the middle of a
+    command.
+
+    Tasks and history records are returned as tuples in column order
+    (see Task and History). Selects return iterators that fetch rows lazily.
+    """
+
+    # Path of the database file (None when it has none)
+    database = None
+    readonly = False
+    # Run maintain() after this many writes (0 never does)
+    maintain_every = 0
+
+    @abstractmethod
+    def create_schema(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def schema_version(self):
+        """Number of MIGRATIONS applied to the database."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def migrate(self):
+        """Bring an existing database up to date with the current schema."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def health(self):
+        """Sizes, fragmentation, index usage and integrity of the database."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def maintain(self, analyze=False, busy_timeout=None):
+        """
+        Reclaim free pages and refresh query planner statistics, waiting at
+        most busy_timeout milliseconds for locks (if given). Only without
+        busy_timeout is a database converted to incremental auto_vacuum.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def backup_to(self, path):
+        """Copy the whole database to a new SQLite database file at `path`."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def transaction(self, immediate=False):
+        """
+        Context manager that commits everything inside it at once (or nothing).
+
+        With immediate=True the write lock is taken up front.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def savepoint(self):
+        """
+        Context manager that undoes everything inside it if it raises, but
+        leaves the transaction around it going.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def select_tasks(
+        self,
+        taskid=None,
+        name=None,
+        starts_with=None,
+        contains=None,
+        statuses=None,
+        tags=None,
+        any_tag=False,
+        by_status=False,
+    ):
+        """
+        Tasks matching all given filters, most recently modified first
+        (grouped by status first if by_status). `name` matches exactly, while
+        starts_with and contains ignore case. Tasks need all of `tags`, or
+        any of them with any_tag.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def select_meta(self, key):
+        """The integer stored under `key` in the meta table (None if there's none)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_meta(self, key, value):
+        raise NotImplementedError
+
+    @abstractmethod
+    def select_tags(self, taskids):
+        """(task id, tag) of the given tasks, ordered by task then tag."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def insert_tags(self, taskid, tags):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_tags(self, taskid, tags):
+        raise NotImplementedError
+
+    @abstractmethod
+    def select_history(self, taskids):
+        """History of the given tasks, ordered by task then time."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def select_history_by_time(self):
+        """All history, ordered by time then id."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def select_history_tail(self, taskid, last=None, since=None):
+        """The task's last `last` history records, or those from `since` on, by time."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def select_history_before(self, taskid, before=None, limit=1):
+        """The task's `limit` latest history records before time `before`, latest first."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def select_task_tree(self, at, root=None):
+        """
+        Every task under `root` (or all tasks, starting from those without a
+        parent) depth first, each row being the task's columns followed by its
+        depth, its progress, and the progress, estimate and number of tasks
+        of everything under it. Open sessions count up to `at`.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def select_ancestor_ids(self, taskid):
+        """Ids of the task's parent, its parent's parent, and so on."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def insert_task(self, task):
+        """Returns the new task's id."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def insert_history(self, history):
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_task(self, taskid, field, value, last_modified):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_task(self, taskid):
+        """Delete a task, its history and tags. Its subtasks move up to its parent."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_history(self, historyid):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_task_history(self, taskid):
+        raise NotImplementedError
+
+    @abstractmethod
+    def estimate_accuracy_rows(self):
+        """
+        One row per finished, estimated task: (taskid, estimate, actual seconds,
+        finish time), ordered by finish time.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def select_sessions(self, since=None, until=None):
+        """
+        (taskid, task name, start, stop) of every work session overlapping
+        [since, until), ordered by start. stop is None for the open session.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def summary(self, at):
+        """
+        (status, task count, total estimate) rows and the total time tracked
+        across all tasks, counting open sessions up to `at`.
+        """
+        raise NotImplementedError
+
+
+class SQLiteStorage(Storage):
+    # Connections may only be used by the thread that opened them
+    check_same_thread = True
+
+    def __init__(self, database, readonly=False, mmap_size=None):
+        self.database = database
+        self.readonly = readonly
+        self.mmap_size = settings.MMAP_SIZE if mmap_size is None else mmap_size
+        self.transaction_conn = None
+        # Run maintenance every this many write transactions (0 disables)
+        self.maintain_every = 0
+
+    def create_schema(self):
+        # Must be set before the first table is created to take effect
+        self.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self.execute(
+            "CREATE TABLE {table}(id INTEGER PRIMARY KEY, name TEXT, estimate INTEGER, "
+            "description TEXT, status TEXT, last_modified INTEGER)".format(table=TASKS_TABLE)
+        )
+        self.execute(
+            "CREATE TABLE {table}(id INTEGER PRIMARY KEY, taskid INTEGER, is_start BOOLEAN, "
+            "time INTEGER)".format(table=HISTORY_TABLE)
+        )
+        self.migrate()
+
+    def migrate(self):
+        if self.schema_version() >= len(MIGRATIONS):
+            return
+        self.execute("PRAGMA journal_mode = WAL")
+        with self.transaction(immediate=True):
+            # Another process may have migrated while we waited for the lock
+            version = self.schema_version()
+            for statements in MIGRATIONS[version:]:
+                for statement in statements:
+                    self.execute(statement)
+            self.execute("PRAGMA user_version = %d" % len(MIGRATIONS))
+
+    def schema_version(self):
+        return self.execute("PRAGMA user_version")[0][0]
+
+    def health(self):
+        with self.connect() as conn:
+
+            def pragma(name):
+                return conn.execute("PRAGMA " + name).fetchone()[0]
+
+            report = {
+                "page_size": pragma("page_size"),
+                "page_count": pragma("page_count"),
+                "freelist_count": pragma("freelist_count"),
+                "auto_vacuum": ("none", "full", "incremental")[pragma("auto_vacuum")],
+                "integrity": pragma("quick_check"),
+                "writes": conn.execute("SELECT value FROM meta WHERE key='writes'").fetchone()[0],
+                "analyzed": bool(conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1'").fetchone()),
+            }
+
+            table_bytes = {}
+            try:
+                table_bytes = dict(conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name"))
+            except sqlite3.OperationalError:
+                pass  # SQLite built without the dbstat virtual table
+            report["tables"] = [
+                (
+                    table,
+                    conn.execute("SELECT COUNT(*) FROM {table}".format(table=table)).fetchone()[0],
+                    table_bytes.get(table),
+                )
+                for table in (TASKS_TABLE, HISTORY_TABLE, TAGS_TABLE)
+            ]
+            report["indexes"] = [
+                (name, table, table_bytes.get(name))
+                for name, table in conn.execute(
+                    "SELECT name, tbl_name FROM sqlite_master WHERE type='index' ORDER BY name"
+                )
+            ]
+            report["query_plans"] = [
+                (
+                    description,
+                    "; ".join(
+                        row[-1] for row in conn.execute(
+                            "EXPLAIN QUERY PLAN "
+                            + sql.format(tasks=TASKS_TABLE, history=HISTORY_TABLE, tags=TAGS_TABLE),
+                            ("",),
+                        )
+                    ),
+                )
+                for description, sql in QUERY_PLANS
+            ]
+        return report
+
+    def maintain(self, analyze=False, busy_timeout=None):
+        conn = self.open_connection()
+        if busy_timeout is not None:
+            previous_timeout = conn.execute("PRAGMA busy_timeout").fetchone()[0]
+            conn.execute("PRAGMA busy_timeout = %d" % busy_timeout)
+        try:
+            # VACUUM and friends can't run inside a transaction
+            conn.isolation_level = None
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                # Switching an existing database to incremental needs one full
+                # VACUUM, which rewrites the whole file, so that's left to an
+                # explicit `hunt maintain` (without busy_timeout)
+                if busy_timeout is None:
+                    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                    conn.execute("VACUUM")
+            else:
+                # execute() only steps once (freeing one page); a script runs to completion
+                conn.executescript("PRAGMA incremental_vacuum;")
+            if analyze:
+                conn.execute("ANALYZE")
+            conn.execute("PRAGMA optimize")
+            conn.execute("UPDATE meta SET value = 0 WHERE key = 'writes'")
+        finally:
+            conn.isolation_level = ""
+            if busy_timeout is not None:
+                conn.execute("PRAGMA busy_timeout = %d" % previous_timeout)
+            self.close_connection(conn)
+
+    def select_tasks(
+        self,
+        taskid=None,
+        name=None,
+        starts_with=None,
+        contains=None,
+        statuses=None,
+        tags=None,
+        any_tag=False,
+        by_status=False,
+    ):
+        where_clause_param_tuples = []
+        if taskid is not None:
+            where_clause_param_tuples.append(("id=?", (taskid,)))
+        if name is not None:
+            where_clause_param_tuples.append(("name=?", (name,)))
+        if starts_with:
+            where_clause_param_tuples.append(
+                ("name LIKE ? ESCAPE '\\'", (escape_like(starts_with) + "%",))
+            )
+        if contains:
+            where_clause_param_tuples.append(
+                ("name LIKE ? ESCAPE '\\'", ("%" + escape_like(contains) + "%",))
+            )
+        if statuses:
+            where_clause_param_tuples.append(
+                ("status IN (" + ",".join(len(statuses) * "?") + ")", tuple(statuses))
+            )
+        if tags:
+            # Driven from the tags primary key, so only tagged tasks are read
+            tags = sorted(set(tags))
+            tagged_sql = "SELECT task_id FROM {tags} WHERE tag IN ({marks})".format(
+                tags=TAGS_TABLE, marks=",".join(len(tags) * "?")
+            )
+            if not any_tag and len(tags) > 1:
+                tagged_sql += " GROUP BY task_id HAVING COUNT(*) = %d" % len(tags)
+            where_clause_param_tuples.append(("id IN (" + tagged_sql + ")", tuple(tags)))
+        if where_clause_param_tuples:
+            where_clauses, where_params = zip(*where_clause_param_tuples)
+            where_clause = " AND ".join(where_clauses)
+            params = [param for params in where_params for param in params]
+        else:
+            where_clause = None
+            params = None
+
+        order_by = TASK_ORDER if by_status else "last_modified DESC"
+        return self.select_from_table(
+            TASKS_TABLE, where_clause=where_clause, order_by=order_by, params=params
+        )
+
+    def select_history(self, taskids):
+        # Chunked to stay under SQLite's limit on the number of parameters
+        taskids = sorted(taskids)
+        for i in range(0, len(taskids), BATCH_SIZE):
+            chunk = taskids[i:i + BATCH_SIZE]
+            where_clause = "taskid IN (" + ",".join(len(chunk) * "?") + ")"
+            yield from self.select_from_table(
+                HISTORY_TABLE,
+                where_clause=where_clause,
+                order_by="taskid, time, is_start DESC, id",
+                params=chunk,
+            )
+
+    def select_history_tail(self, taskid, last=None, since=None):
+        # Read backwards along history(taskid, time), so only the tail is touched
+        where_clause = "taskid=?"
+        params = [taskid]
+        if since is not None:
+            where_clause += " AND time >= ?"
+            params.append(since)
+        sql = "SELECT * FROM {table} WHERE " + where_clause + " ORDER BY time DESC, id DESC"
+        if last is not None:
+            sql += " LIMIT ?"
+            params.append(last)
+        sql = "SELECT * FROM (" + sql + ") ORDER BY time, id"
+        return self.iterate(sql.format(table=HISTORY_TABLE), params)
+
+    def select_history_before(self, taskid, before=None, limit=1):
+        where_clause = "taskid=?"
+        params = [taskid]
+        if before is not None:
+            where_clause += " AND time < ?"
+            params.append(before)
+        params.append(limit)
+        sql = "SELECT * FROM {table} WHERE " + where_clause + " ORDER BY time DESC, id DESC LIMIT ?"
+        return self.iterate(sql.format(table=HISTORY_TABLE), params)
+
+    def select_meta(self, key):
+        rows = self.execute("SELECT value FROM meta WHERE key=?", (key,))
+        return rows[0][0] if rows else None
+
+    def update_meta(self, key, value):
+        self.execute("INSERT OR REPLACE INTO meta(key, value) VALUES (?,?)", (key, value))
+
+    def select_tags(self, taskids):
+        taskids = sorted(taskids)
+        for i in range(0, len(taskids), BATCH_SIZE):
+            chunk = taskids[i:i + BATCH_SIZE]
+            sql = "SELECT task_id, tag FROM {table} WHERE task_id IN ({marks}) ORDER BY task_id, tag"
+            yield from self.iterate(
+                sql.format(table=TAGS_TABLE, marks=",".join(len(chunk) * "?")), chunk
+            )
+
+    def insert_tags(self, taskid, tags):
+        sql = "INSERT OR IGNORE INTO {table} (tag,task_id) VALUES (?,?)".format(table=TAGS_TABLE)
+        with self.connect() as conn:
+            conn.executemany(sql, [(tag, taskid) for tag in tags])
+
+    def delete_tags(self, taskid, tags):
+        sql = "DELETE FROM {table} WHERE tag=? AND task_id=?".format(table=TAGS_TABLE)
+        with self.connect() as conn:
+            conn.executemany(sql, [(tag, taskid) for tag in tags])
+
+    def select_history_by_time(self):
+        # (time, id) is the order of the history(time) index, so no sorting
+        return self.select_from_table(HISTORY_TABLE, order_by="time, id")
+
+    def select_from_table(self, table, where_clause=None, order_by=None, params=None):
+        assert table in (TASKS_TABLE, HISTORY_TABLE)
+        sql = "SELECT * FROM {table}".format(table=table)
+        if where_clause:
+            sql += " WHERE " + where_clause
+        if order_by:
+            sql += " ORDER BY " + order_by
+        return self.iterate(sql, params)
+
+    def select_task_tree(self, at, root=None):
+        if root is None:
+            roots = "parent_id IS NULL OR parent_id NOT IN (SELECT id FROM {tasks})"
+            params = [at, at]
+        else:
+            roots = "id = ?"
+            params = [root, at, at]
+        sql = TASK_TREE_SQL.format(
+            tasks=TASKS_TABLE, history=HISTORY_TABLE, roots=roots.format(tasks=TASKS_TABLE)
+        )
+        return self.iterate(sql, params)
+
+    def select_ancestor_ids(self, taskid):
+        # UNION (rather than UNION ALL) stops at a cycle instead of looping
+        sql = (
+            "WITH RECURSIVE ancestors(id) AS ("
+            "SELECT parent_id FROM {tasks} WHERE id = ? "
+            "UNION SELECT t.parent_id FROM {tasks} t JOIN ancestors ON t.id = ancestors.id) "
+            "SELECT id FROM ancestors WHERE id IS NOT NULL"
+        ).format(tasks=TASKS_TABLE)
+        return [row[0] for row in self.execute(sql, (taskid,))]
+
+    def insert_task(self, task):
+        sql = (
+            "INSERT INTO {table} "
+            "(name,estimate,description,status,last_modified,parent_id) "
+            "VALUES (?,?,?,?,?,?)"
+        ).format(table=TASKS_TABLE)
+        with self.connect() as conn:
+            cursor = conn.execute(
+                sql,
+                (
+                    task.name,
+                    task.estimate,
+                    task.description,
+                    task.status,
+                    task.last_modified,
+                    task.parent_id,
+                ),
+            )
+        return cursor.lastrowid
+
+    def insert_history(self, history):
+        sql = ("INSERT INTO {table} (taskid,is_start,time) VALUES " "(?,?,?)").format(
+            table=HISTORY_TABLE
+        )
+        self.execute(sql, (history.taskid, history.is_start, history.time))
+
+    def update_task(self, taskid, field, value, last_modified):
+        sql = ("UPDATE {table} SET {field}=?, last_modified=? " "WHERE id=?").format(
+            table=TASKS_TABLE, field=field
+        )
+        self.execute(sql, (value, last_modified, taskid))
+
+    def delete_task(self, taskid):
+        reparent_sql = (
+            "UPDATE {table} SET parent_id=(SELECT parent_id FROM {table} WHERE id=?) "
+            "WHERE parent_id=?"
+        ).format(table=TASKS_TABLE)
+        delete_task_sql = "DELETE from {table} WHERE id=?".format(table=TASKS_TABLE)
+        with self.transaction():
+            self.execute(reparent_sql, (taskid, taskid))
+            self.execute(delete_task_sql, (taskid,))
+            self.delete_task_history(taskid)
+            self.execute("DELETE from {table} WHERE task_id=?".format(table=TAGS_TABLE), (taskid,))
+
+    def delete_history(self, historyid):
+        sql = "DELETE from {table} WHERE id=?".format(table=HISTORY_TABLE)
+        self.execute(sql, (historyid,))
+
+    def delete_task_history(self, taskid):
+        sql = "DELETE from {table} WHERE taskid=?".format(table=HISTORY_TABLE)
+        self.execute(sql, (taskid,))
+
+    def estimate_accuracy_rows(self):
+        # Actual time is aggregated in SQL (stops minus starts), so the whole
+        # history is summarized in a single query. Tasks finished without
+        # being stopped end on a Start, which has no actual time to compare,
+        # so they're left out (the last record is one history(taskid, time)
+        # index lookup).
+        sql = (
+            "SELECT {tasks}.id, {tasks}.estimate, "
+            "SUM(CASE WHEN {history}.is_start THEN -{history}.time ELSE {history}.time END), "
+            "MAX({history}.time) "
+            "FROM {tasks} JOIN {history} ON {history}.taskid = {tasks}.id "
+            "WHERE {tasks}.status = ? AND {tasks}.estimate > 0 "
+            "AND NOT (SELECT last.is_start FROM {history} last WHERE last.taskid = {tasks}.id "
+            "ORDER BY last.time DESC, last.id DESC LIMIT 1) "
+            "GROUP BY {tasks}.id "
+            "ORDER BY MAX({history}.time)"
+        ).format(tasks=TASKS_TABLE, history=HISTORY_TABLE)
+        return self.iterate(sql, (FINISHED,))
+
+    def select_sessions(self, since=None, until=None):
+        # Sessions never overlap, so the only one that starts before `since`
+        # and is still going is the one that started last. That bounds the
+        # scan on history(time) from below; each stop is then a single
+        # history(taskid, time) index lookup.
+        where_clauses = ["h.is_start"]
+        params = []
+        if since is not None:
+            where_clauses.append(
+                "h.time >= COALESCE((SELECT time FROM {history} WHERE time <= ? AND is_start "
+                "ORDER BY time DESC LIMIT 1), ?)"
+            )
+            params.extend([since, since])
+        if until is not None:
+            where_clauses.append("h.time < ?")
+            params.append(until)
+        sql = (
+            "SELECT * FROM ("
+            "SELECT h.taskid, t.name, h.time AS start, "
+            "(SELECT MIN(s.time) FROM {history} s "
+            "WHERE s.taskid = h.taskid AND s.time >= h.time AND NOT s.is_start) AS stop "
+            "FROM {history} h JOIN {tasks} t ON t.id = h.taskid "
+            "WHERE " + " AND ".join(where_clauses) + ")"
+        )
+        if since is not None:
+            sql += " WHERE stop IS NULL OR stop > ?"
+            params.append(since)
+        sql += " ORDER BY start"
+        return self.iterate(sql.format(history=HISTORY_TABLE, tasks=TASKS_TABLE), params)
+
+    def summary(self, at):
+        status_sql = (
+            "SELECT status, COUNT(*), SUM(estimate) FROM {table} GROUP BY status"
+        ).format(table=TASKS_TABLE)
+        # A Start counts up to `at` and its Stop takes back the time after it,
+        # so open sessions are included without pairing records up
+        tracked_sql = (
+            "SELECT SUM(CASE WHEN is_start THEN ? - time ELSE time - ? END) FROM {table}"
+        ).format(table=HISTORY_TABLE)
+        with self.connect() as conn:
+            status_rows = conn.execute(status_sql).fetchall()
+            tracked = conn.execute(tracked_sql, (at, at)).fetchone()[0]
+        return status_rows, tracked or 0
+
+    def execute(self, sql, sql_params=None):
+        if sql_params is None:
+            sql_params = []
+        with self.connect() as conn:
+            rows = conn.execute(sql, sql_params).fetchall()
+        return rows
+
+    def iterate(self, sql, sql_params=None, batch_size=BATCH_SIZE):
+        """Like execute, but yields rows lazily, fetching batch_size at a time."""
+        if sql_params is None:
+            sql_params = []
+        with self.connect() as conn:
+            cursor = conn.execute(sql, sql_params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        if self.transaction_conn is not None:
+            yield
+            return
+        conn = self.open_connection()
+        self.transaction_conn = conn
+        try:
+            if immediate:
+                conn.execute("BEGIN IMMEDIATE")
+            yield
+            writes = self.count_write(conn)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self.transaction_conn = None
+            self.close_connection(conn)
+        self.maintain_if_due(writes)
+
+    @contextmanager
+    def savepoint(self):
+        with self.transaction():
+            self.execute("SAVEPOINT hunt_savepoint")
+            try:
+                yield
+            except BaseException:
+                self.execute("ROLLBACK TO hunt_savepoint")
+                self.execute("RELEASE hunt_savepoint")
+                raise
+            self.execute("RELEASE hunt_savepoint")
+
+    @contextmanager
+    def connect(self):
+        if self.transaction_conn is not None:
+            yield self.transaction_conn
+            return
+        conn = self.open_connection()
+        try:
+            yield conn
+            writes = self.count_write(conn)
+            conn.commit()
+        finally:
+            self.close_connection(conn)
+        self.maintain_if_due(writes)
+
+    def backup_to(self, path):
+        target = sqlite3.connect(path)
+        try:
+            with self.connect() as conn:
+                conn.backup(target, pages=BACKUP_PAGES, sleep=0.01)
+        finally:
+            target.close()
+
+    def count_write(self, conn):
+        """Count a transaction that changed something; returns writes since maintenance."""
+        if not self.maintain_every or not conn.in_transaction:
+            return 0
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'writes'")
+        return conn.execute("SELECT value FROM meta WHERE key = 'writes'").fetchone()[0]
+
+    def maintain_if_due(self, writes):
+        if self.maintain_every and writes >= self.maintain_every:
+            # The write already committed, so never wait on (or fail because
+            # of) another connection; the count isn't reset, so the next
+            # write tries again
+            try:
+                self.maintain(busy_timeout=0)
+            except sqlite3.OperationalError:
+                pass
+
+    def open_connection(self):
+        if self.readonly:
+            conn = sqlite3.connect(
+                "file:%s?mode=ro" % pathname2url(self.database),
+                uri=True,
+                check_same_thread=self.check_same_thread,
+            )
+            conn.execute("PRAGMA query_only = ON")
+            conn.execute("PRAGMA mmap_size = %d" % self.mmap_size)
+            return conn
+        return sqlite3.connect(self.database, check_same_thread=self.check_same_thread)
+
+    def close_connection(self, conn):
+        conn.close()
+
+
+class PersistentStorage(SQLiteStorage):
+    """
+    Keeps one connection to the database open until close(), rather than
+    opening one per operation (for long running processes like hunt serve).
+    Any thread may use it, but only one at a time.
+    """
+
+    check_same_thread = False
+
+    def __init__(self, database, readonly=False, mmap_size=None):
+        super().__init__(database, readonly=readonly, mmap_size=mmap_size)
+        self.conn = None
+
+    def open_connection(self):
+        if self.conn is None:
+            self.conn = super().open_connection()
+        return self.conn
+
+    def close_connection(self, conn):
+        pass
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class MemoryStorage(SQLiteStorage):
+    """
+    Everything is kept in memory and lost when the object goes away.
+
+    Uses one private in-memory SQLite connection, so it runs exactly the same
+    queries as SQLiteStorage without touching disk.
+    """
+
+    def __init__(self):
+        super().__init__(None)
+        self.conn = sqlite3.connect(":memory:")
+        self.create_schema()
+
+    def open_connection(self):
+        return self.conn
+
+    def close_connection(self, conn):
+        pass
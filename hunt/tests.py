@@ -1,11 +1,72 @@
+import asyncio
+import calendar
 import os
 import shutil
+import socket
 import sqlite3
 import tempfile
+import threading
+import time
+from inspect import getdoc
+from io import StringIO
 from unittest import TestCase
+from unittest.mock import patch
+
+from docopt import docopt
+from rich.console import Console
 
 from hunt import settings
+from .backup import list_snapshots
+from .backup import take_snapshot
+from .check import MULTIPLE_CURRENT
+from .check import ORPHAN
+from .check import OVERLAP
+from .check import UNPAIRED_START
+from .check import UNPAIRED_STOP
+from .check import WRONG_STATUS
+from .cli import Command
+from .cli_dispatcher import AmbiguousCommand
+from .cli_dispatcher import Dispatcher
+from .cli_dispatcher import NoSuchCommand
+from .completion import completion_cache_path
+from .constants import CURRENT
+from .constants import FINISHED
+from .constants import HuntCouldNotFindTaskError
+from .constants import HuntError
+from .constants import HuntInvalidTimeError
+from .constants import HuntTaskValidationError
+from .constants import IN_PROGRESS
+from .constants import TODO
+from .databases import database_label
+from .databases import database_paths
+from .databases import list_tasks
+from .databases import summarize
+from .git import current_branch
+from .git import default_branches
+from .git import find_git_dir
+from .git import install_post_checkout_hook
+from .hunt import History
 from .hunt import Hunt
+from .hunt import Task
+from .journal import CREATE
+from .journal import STOP
+from .journal import WORKON
+from .journal import append_event
+from .journal import failed_path
+from .journal import folding_path
+from .journal import journal_path
+from .stats import build_columns
+from .stats import estimate_accuracy
+from .remote import RemoteHunt
+from .server import HuntServer
+from .storage import BATCH_SIZE
+from .storage import MemoryStorage
+from .storage import SQLiteStorage
+from .storage import Storage
+from .utils import display_time
+from .utils import parse_tags
+from .utils import parse_task
+from .utils import parse_time
 
 
 class TestHunt(TestCase):
@@ -28,3 +89,869 @@ class TestHunt(TestCase):
 
         hunt = Hunt('/database.db')
         self.assertEqual(hunt.database, '/database.db')
+
+
+class HuntTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.settings = {
+            'HUNT_DIR': settings.HUNT_DIR,
+            'DATABASE': settings.DATABASE,
+            'BACKUP_DIR': settings.BACKUP_DIR,
+        }
+        settings.HUNT_DIR = os.path.join(self.tmp_dir, 'hunt')
+        settings.DATABASE = os.path.join(settings.HUNT_DIR, 'database.db')
+        settings.BACKUP_DIR = os.path.join(settings.HUNT_DIR, 'backups')
+        Command().init({}, console=Console(file=StringIO()))
+        self.hunt = Hunt()
+
+    def tearDown(self):
+        for name, value in self.settings.items():
+            setattr(settings, name, value)
+        shutil.rmtree(self.tmp_dir)
+
+    def add_session(self, taskid, start, stop):
+        self.hunt.insert_history(History((None, taskid, True, start)))
+        self.hunt.insert_history(History((None, taskid, False, stop)))
+
+
+class TestStats(HuntTestCase):
+    def test_estimate_accuracy(self):
+        for name, estimate, hours in [('a', 1, 2), ('b', 2, 2), ('c', 4, 2), ('d', None, 3)]:
+            task = self.hunt.create_task(name, estimate=estimate)
+            self.add_session(task.id, 1000, 1000 + hours * 3600)
+            self.hunt.finish_task(task.id)
+        self.hunt.create_task('todo', estimate=1)
+
+        rows = list(self.hunt.get_estimate_accuracy_rows())
+        self.assertEqual([row[2] for row in rows], [7200, 7200, 7200])
+
+        accuracy = estimate_accuracy(build_columns(rows), window=2)
+        self.assertEqual(accuracy['count'], 3)
+        self.assertEqual(dict(accuracy['percentiles'])[50], 1.0)
+        self.assertEqual(
+            [(bucket['label'], bucket['mean_ratio']) for bucket in accuracy['buckets']],
+            [('1 hr', 2.0), ('2 hrs', 1.0), ('3-4 hrs', 0.5)],
+        )
+        self.assertEqual([ratio for _, ratio in accuracy['trend']], [1.5, 0.75])
+
+    def test_window_must_be_a_number(self):
+        with self.assertRaises(HuntError):
+            Command().stats({'--window': 'x'}, console=Console(file=StringIO()))
+
+    def test_finished_while_started_is_skipped(self):
+        task = self.hunt.create_task('open', estimate=1)
+        self.add_session(task.id, 1000, 4600)
+        self.hunt.insert_history(History((None, task.id, True, 5000)))
+        self.hunt.finish_task(task.id)
+
+        self.assertEqual(list(self.hunt.get_estimate_accuracy_rows()), [])
+
+
+class TestDispatcher(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.tmp_dir, 'commands.cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def dispatcher(self, cache_key='1'):
+        return Dispatcher(
+            Command(), {'options_first': True}, cache_path=self.cache_path, cache_key=cache_key)
+
+    def test_parse_matches_docopt(self):
+        argv = ['-s', 'wo', 'my-task', '--create', '-e', '3']
+        options, handler, command_options = self.dispatcher().parse(argv)
+        self.assertEqual(handler.__name__, 'workon')
+        self.assertTrue(command_options['--silent'])
+        self.assertEqual(options, docopt(getdoc(Command.workon), argv[2:]))
+
+    def test_cached_table(self):
+        self.dispatcher().parse(['ls'])
+        self.assertTrue(os.path.exists(self.cache_path))
+
+        dispatcher = self.dispatcher()
+        options, handler, _ = dispatcher.parse(['ls', '-a'])
+        self.assertEqual(handler.__name__, 'ls')
+        self.assertTrue(options['--all'])
+
+        with self.assertRaises(AmbiguousCommand):
+            dispatcher.parse(['s'])
+        with self.assertRaises(AmbiguousCommand) as ambiguous:
+            dispatcher.parse(['r'])
+        self.assertEqual(ambiguous.exception.candidates, ['report', 'restart', 'rm'])
+        for prefix, name in [('c', 'create'), ('l', 'ls'), ('re', 'restart'), ('st', 'stop')]:
+            self.assertEqual(dispatcher.table.resolve(prefix), name)
+        with self.assertRaises(NoSuchCommand):
+            dispatcher.parse(['nope'])
+
+
+class TestCompletion(HuntTestCase):
+    def read_cache(self):
+        with open(completion_cache_path(self.hunt.database)) as cache:
+            return cache.read().split('\n')
+
+    def test_cache_follows_open_tasks(self):
+        first = self.hunt.create_task('first')
+        second = self.hunt.create_task('second')
+        self.assertEqual(
+            sorted(self.read_cache()), sorted(['first', 'second', str(first.id), str(second.id), '']))
+
+        self.hunt.finish_task(first.id)
+        self.assertNotIn('first', self.read_cache())
+
+        self.hunt.workon_task(first.id)
+        self.assertIn('first', self.read_cache())
+
+        self.hunt.remove_task(second.id)
+        self.assertNotIn('second', self.read_cache())
+
+
+class TestMemoryStorage(TestCase):
+    def test_domain_methods(self):
+        hunt = Hunt(storage=MemoryStorage())
+        self.assertIsNone(hunt.database)
+
+        first = hunt.create_task('first', estimate=2)
+        second = hunt.create_task('second')
+        hunt.workon_task(first.id)
+        hunt.workon_task('sec')
+        self.assertEqual(hunt.get_current_task(), second)
+        self.assertEqual(hunt.get_task('first').status, IN_PROGRESS)
+
+        hunt.stop_current_task()
+        hunt.finish_task(first.id)
+        self.assertEqual(
+            [(task.name, task.status) for task in hunt.get_tasks()],
+            [('second', IN_PROGRESS), ('first', FINISHED)],
+        )
+        self.assertEqual(len(hunt.get_history([first.id, second.id])), 4)
+
+        hunt.remove_task(first.id)
+        self.assertEqual(hunt.get_tasks(), [second])
+        self.assertEqual(hunt.get_history(first.id), [])
+
+    def test_partial_backend(self):
+        class PartialStorage(Storage):
+            def create_schema(self):
+                pass
+
+        with self.assertRaises(TypeError):
+            PartialStorage()
+
+    def test_create_task_named_like_another(self):
+        hunt = Hunt(storage=MemoryStorage())
+        longer = hunt.create_task('fix-login')
+        task = hunt.create_task('fix')
+        self.assertEqual(task.name, 'fix')
+        self.assertNotEqual(task.id, longer.id)
+
+
+class TestJournal(HuntTestCase):
+    def test_fold_journal(self):
+        path = journal_path(self.hunt.database)
+        task = self.hunt.create_task('existing')
+        append_event(path, WORKON, 1000, 'exi')
+        append_event(path, CREATE, 1100, 'new-task')
+        append_event(path, STOP, 1200)
+        append_event(path, STOP, 1300)
+        with open(path, 'a') as journal:
+            journal.write('0000001400 W cut-sh')
+
+        hunt = Hunt()
+        self.assertFalse(os.path.exists(path))
+        new_task = hunt.get_task('new-task')
+        self.assertEqual(hunt.get_task(task.id).status, IN_PROGRESS)
+        self.assertEqual(new_task.status, IN_PROGRESS)
+        self.assertEqual(
+            [(record.taskid, record.is_start, record.time)
+             for record in hunt.get_history([task.id, new_task.id])],
+            [(task.id, 1, 1000), (task.id, 0, 1100), (new_task.id, 1, 1100), (new_task.id, 0, 1200)],
+        )
+
+    def test_fold_is_not_replayed(self):
+        path = journal_path(self.hunt.database)
+        first = self.hunt.create_task('first')
+        second = self.hunt.create_task('second')
+        append_event(path, WORKON, 1000, 'first')
+        append_event(path, WORKON, 2000, 'second')
+
+        # Crash after the fold committed, before its file was removed
+        with patch('hunt.journal.os.remove', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                Hunt()
+        self.assertTrue(os.path.exists(folding_path(path)))
+        append_event(path, STOP, 3000)
+
+        hunt = Hunt()
+        self.assertFalse(os.path.exists(folding_path(path)))
+        self.assertEqual(
+            [(record.taskid, record.is_start, record.time)
+             for record in hunt.get_history([first.id, second.id])],
+            [(first.id, 1, 1000), (first.id, 0, 2000), (second.id, 1, 2000), (second.id, 0, 3000)],
+        )
+
+    def test_create_named_like_another(self):
+        path = journal_path(self.hunt.database)
+        self.hunt.create_task('fix-login')
+        append_event(path, CREATE, 1000, 'fix')
+
+        hunt = Hunt()
+        self.assertEqual(hunt.get_current_task().name, 'fix')
+
+    def test_bad_event_does_not_stop_fold(self):
+        path = journal_path(self.hunt.database)
+        first = self.hunt.create_task('first')
+        second = self.hunt.create_task('second')
+        # Two Current tasks make workon fail with an AssertionError
+        self.hunt.update_task(first.id, 'status', CURRENT)
+        self.hunt.update_task(second.id, 'status', CURRENT)
+        append_event(path, WORKON, 1000, 'first')
+        append_event(path, CREATE, 1100, 'third')
+        os.replace(path, folding_path(path))  # as if a fold crashed
+
+        hunt = Hunt()
+        self.assertFalse(os.path.exists(folding_path(path)))
+        # The failed create was undone along with the rest of its event
+        with self.assertRaises(HuntCouldNotFindTaskError):
+            hunt.get_task('third')
+        with open(failed_path(path)) as failed:
+            self.assertEqual(
+                failed.read(), '0000001000 W first\n0000001100 C third\n')
+        self.assertEqual(hunt.get_history([first.id, second.id]), [])
+
+
+class TestCheckWithJournal(HuntTestCase):
+    def test_fix_before_folding(self):
+        first = self.hunt.create_task('first')
+        second = self.hunt.create_task('second')
+        self.hunt.update_task(first.id, 'status', CURRENT)
+        self.hunt.update_task(second.id, 'status', CURRENT)
+        path = journal_path(self.hunt.database)
+        append_event(path, WORKON, 1000, 'first')
+
+        Command().check({'--fix': True}, console=Console(file=StringIO()))
+        hunt = Hunt()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(failed_path(path)))
+        self.assertEqual(hunt.get_current_task().id, first.id)
+        self.assertEqual(hunt.get_task(second.id).status, TODO)
+        self.assertEqual(hunt.check(), [])
+
+
+class TestCheckCommand(HuntTestCase):
+    def test_fix_rechecks_under_lock(self):
+        task = self.hunt.create_task('task')
+        self.hunt.update_task(task.id, 'status', CURRENT)  # with no history
+
+        def hook_writes(hunt, label=None):
+            # A hook starts the task between the check and the fix
+            Hunt().insert_history(History((None, task.id, True, 1000)))
+
+        output = StringIO()
+        with patch.object(Hunt, 'backup', hook_writes):
+            Command().check({'--fix': True}, console=Console(file=output))
+        self.assertIn('Fixed 0 problems', output.getvalue())
+        self.assertEqual(self.hunt.get_task(task.id).status, CURRENT)
+
+    def test_unfixable_problems_are_not_counted(self):
+        first = self.hunt.create_task('first')
+        second = self.hunt.create_task('second')
+        self.hunt.workon_task(first.id, at=1000)
+        self.hunt.update_task(second.id, 'status', CURRENT)
+
+        output = StringIO()
+        Command().check({'--fix': True}, console=Console(file=output, width=200))
+        self.assertIn('Fixed 1 problems', output.getvalue())
+        self.assertIn('Not fixed', output.getvalue())
+
+
+class TestReadOnly(HuntTestCase):
+    def test_readonly_connections(self):
+        task = self.hunt.create_task('task')
+        self.assertEqual(self.hunt.storage.execute("PRAGMA journal_mode")[0][0], 'wal')
+
+        hunt = Hunt(readonly=True)
+        self.assertEqual(hunt.get_task('task').id, task.id)
+        with hunt.storage.connect() as conn:
+            self.assertEqual(conn.execute("PRAGMA query_only").fetchone()[0], 1)
+            self.assertEqual(conn.execute("PRAGMA mmap_size").fetchone()[0], settings.MMAP_SIZE)
+        with self.assertRaises(sqlite3.OperationalError):
+            hunt.finish_task(task.id)
+
+        # Readers don't wait for a writer holding the write lock
+        with self.hunt.transaction(immediate=True):
+            self.hunt.update_task(task.id, 'name', 'renamed')
+            self.assertEqual(hunt.get_task(task.id).name, 'task')
+        self.assertEqual(hunt.get_task(task.id).name, 'renamed')
+
+    def test_readonly_folds_journal_first(self):
+        self.hunt.create_task('task')
+        append_event(journal_path(self.hunt.database), WORKON, 1000, 'task')
+        hunt = Hunt(readonly=True)
+        self.assertEqual(hunt.get_current_task().name, 'task')
+        self.assertFalse(os.path.exists(journal_path(self.hunt.database)))
+
+
+class TestStreaming(TestCase):
+    def test_iter_history_in_batches(self):
+        hunt = Hunt(storage=MemoryStorage())
+        taskids = [hunt.create_task('task-%d' % i).id for i in range(BATCH_SIZE + 10)]
+        for taskid in reversed(taskids):
+            hunt.insert_history(History((None, taskid, False, 20)))
+            hunt.insert_history(History((None, taskid, True, 10)))
+
+        history = hunt.iter_history(taskids)
+        self.assertNotIsInstance(history, list)
+        self.assertEqual(
+            [(record.taskid, record.is_start) for record in history],
+            [(taskid, is_start) for taskid in taskids for is_start in (1, 0)],
+        )
+        self.assertEqual(len(hunt.get_tasks()), len(taskids))
+
+
+class TestDatabases(HuntTestCase):
+    def test_list_and_summarize_across_databases(self):
+        self.hunt.insert_task(Task((None, 'older', None, None, TODO, 1000)))
+        self.hunt.create_task('first-db', estimate=3)
+        other_database = os.path.join(settings.HUNT_DIR, 'other.db')
+        SQLiteStorage(other_database).create_schema()
+        other = Hunt(other_database)
+        task = other.create_task('second-db', estimate=2)
+        other.workon_task(task.id)
+
+        paths = database_paths('*.db')
+        self.assertEqual([database_label(path) for path in paths], ['database', 'other'])
+        self.assertEqual(
+            [(label, task.name) for label, task, _ in list_tasks(paths)],
+            [('other', 'second-db'), ('database', 'first-db'), ('database', 'older')],
+        )
+
+        summaries = dict(summarize(paths))
+        self.assertEqual(summaries['database']['counts'][TODO], 2)
+        self.assertEqual(summaries['database']['estimates'][TODO], 3)
+        self.assertEqual(summaries['other']['counts'][CURRENT], 1)
+
+
+class TestMaintenance(HuntTestCase):
+    def test_health_and_maintain(self):
+        health = self.hunt.get_health()
+        self.assertEqual(health['integrity'], 'ok')
+        self.assertEqual(health['auto_vacuum'], 'incremental')
+        self.assertIn('history_taskid_time', [name for name, _, _ in health['indexes']])
+
+        for i in range(50):
+            self.hunt.create_task('task-%d' % i, description='x' * 1000)
+        for task in self.hunt.get_tasks():
+            self.hunt.remove_task(task.id)
+        self.assertGreater(self.hunt.get_health()['freelist_count'], 0)
+
+        self.hunt.maintain()
+        health = self.hunt.get_health()
+        self.assertEqual(health['freelist_count'], 0)
+        self.assertEqual(health['writes'], 0)
+        self.assertTrue(health['analyzed'])
+
+    def test_maintain_after_writes(self):
+        hunt = Hunt(maintain_every=3)
+        hunt.create_task('first')
+        self.assertEqual(hunt.get_health()['writes'], 1)
+        hunt.create_task('second')
+        hunt.create_task('third')
+        self.assertEqual(hunt.get_health()['writes'], 0)
+
+    def test_maintenance_skipped_while_locked(self):
+        hunt = Hunt(maintain_every=1)
+        hunt.create_task('first')
+        other = sqlite3.connect(hunt.database)
+        other.execute("BEGIN IMMEDIATE")
+        try:
+            started = time.monotonic()
+            hunt.storage.maintain_if_due(1)
+            self.assertLess(time.monotonic() - started, 1)
+            with self.assertRaises(sqlite3.OperationalError):
+                hunt.storage.maintain(busy_timeout=0)
+        finally:
+            other.rollback()
+            other.close()
+        # Retried (and done) on the next write
+        hunt.create_task('second')
+        self.assertEqual(hunt.get_health()['writes'], 0)
+
+    def test_auto_vacuum_converted_only_on_request(self):
+        conn = sqlite3.connect(self.hunt.database)
+        conn.execute("PRAGMA auto_vacuum = NONE")
+        conn.execute("VACUUM")
+        conn.close()
+
+        hunt = Hunt(maintain_every=1)
+        hunt.create_task('first')
+        self.assertEqual(hunt.get_health()['writes'], 0)
+        self.assertEqual(hunt.get_health()['auto_vacuum'], 'none')
+
+        hunt.maintain()
+        self.assertEqual(hunt.get_health()['auto_vacuum'], 'incremental')
+
+
+class TestGitSync(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, path, content):
+        path = os.path.join(self.tmp_dir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_branches_from_git_files(self):
+        self.write('repo/.git/HEAD', 'ref: refs/heads/feature\n')
+        self.write('repo/.git/refs/remotes/origin/HEAD', 'ref: refs/remotes/origin/trunk\n')
+        self.write('repo/.git/worktrees/wt/HEAD', 'ref: refs/heads/other\n')
+        self.write('repo/.git/worktrees/wt/commondir', '../..\n')
+        self.write('wt/.git', 'gitdir: ../repo/.git/worktrees/wt\n')
+        os.makedirs(os.path.join(self.tmp_dir, 'repo', 'src'))
+
+        git_dir = find_git_dir(os.path.join(self.tmp_dir, 'repo', 'src'))
+        self.assertEqual(current_branch(git_dir), 'feature')
+        self.assertEqual(default_branches(git_dir), {'trunk'})
+
+        worktree_git_dir = find_git_dir(os.path.join(self.tmp_dir, 'wt'))
+        self.assertEqual(current_branch(worktree_git_dir), 'other')
+        self.assertEqual(default_branches(worktree_git_dir), {'trunk'})
+
+        hook_path = install_post_checkout_hook(worktree_git_dir)
+        self.assertEqual(hook_path, os.path.join(self.tmp_dir, 'repo', '.git', 'hooks', 'post-checkout'))
+
+    def test_sync_branch(self):
+        hunt = Hunt(storage=MemoryStorage())
+        task = hunt.sync_branch('feature', is_default=False)
+        self.assertEqual(hunt.get_current_task(), task)
+        self.assertEqual(hunt.sync_branch('feature', is_default=False), task)
+        self.assertEqual(len(hunt.get_history(task.id)), 1)
+
+        self.assertIsNone(hunt.sync_branch('main', is_default=True))
+        self.assertIsNone(hunt.get_current_task(required=False))
+        self.assertIsNone(hunt.sync_branch('main', is_default=True))
+
+    def test_sync_branch_named_like_another(self):
+        hunt = Hunt(storage=MemoryStorage())
+        for name in ['fix-login', 'feat-x-long']:
+            hunt.create_task(name)
+        for branch in ['fix', 'feat_x']:
+            task = hunt.sync_branch(branch, is_default=False)
+            self.assertEqual(task.name, branch)
+            self.assertEqual(hunt.get_current_task(), task)
+        self.assertEqual(hunt.sync_branch('fix', is_default=False).name, 'fix')
+        self.assertEqual(len(hunt.get_tasks()), 4)
+
+
+class TestBackup(HuntTestCase):
+    def test_rotating_snapshots(self):
+        task = self.hunt.create_task('backed-up')
+        snapshots = [self.hunt.backup(label='test', keep=2) for _ in range(3)]
+        self.assertEqual(list_snapshots(self.hunt.database), snapshots[1:])
+
+        restored = Hunt(snapshots[-1])
+        self.assertEqual(restored.get_task(task.id).name, 'backed-up')
+
+    def test_other_database_snapshots_are_kept(self):
+        stem = os.path.splitext(os.path.basename(self.hunt.database))[0]
+        other = MemoryStorage()
+        other.database = os.path.join(os.path.dirname(self.hunt.database), stem + '-2.db')
+        other_snapshot = take_snapshot(other, keep=1)
+
+        snapshots = [self.hunt.backup(keep=1) for _ in range(2)]
+        self.assertEqual(list_snapshots(self.hunt.database), snapshots[1:])
+        self.assertEqual(list_snapshots(other.database), [other_snapshot])
+
+    def test_reinit_corrupt_database(self):
+        with open(self.hunt.database, 'wb') as database:
+            database.write(b'not a database' * 100)
+
+        with patch('builtins.input', return_value='y'):
+            Command().init({}, console=Console(file=StringIO()))
+
+        self.assertEqual(Hunt().get_tasks(), [])
+        [snapshot] = list_snapshots(self.hunt.database)
+        with open(snapshot, 'rb') as copy:
+            self.assertEqual(copy.read(), b'not a database' * 100)
+
+
+class TestTaskTree(TestCase):
+    def setUp(self):
+        self.hunt = Hunt(storage=MemoryStorage())
+
+    def add_session(self, taskid, start, stop):
+        self.hunt.insert_history(History((None, taskid, True, start)))
+        self.hunt.insert_history(History((None, taskid, False, stop)))
+
+    def test_rollup(self):
+        epic = self.hunt.create_task('epic', estimate=1)
+        api = self.hunt.create_task('api', estimate=2, parent_id=epic.id)
+        tests = self.hunt.create_task('tests', estimate=3, parent_id=api.id)
+        other = self.hunt.create_task('other')
+        self.add_session(epic.id, 0, 10)
+        self.add_session(api.id, 10, 30)
+        self.add_session(tests.id, 30, 60)
+        self.hunt.workon_task(other.id, at=100)
+
+        tree = self.hunt.get_task_tree()
+        self.assertEqual(
+            [(s.task.name, s.depth, s.progress, s.total_progress, s.total_estimate, s.subtasks)
+             for s in tree[:3]],
+            [('epic', 0, 10, 60, 6, 2), ('api', 1, 20, 50, 5, 1), ('tests', 2, 30, 30, 3, 0)],
+        )
+        self.assertEqual(tree[3].task.name, 'other')
+        self.assertGreater(tree[3].progress, 0)
+        self.assertEqual([s.task.name for s in self.hunt.get_task_tree(root=api.id)], ['api', 'tests'])
+
+        # Filtered out parents are kept above matching subtasks
+        self.hunt.finish_task(epic.id)
+        self.assertEqual(
+            [s.task.name for s in self.hunt.get_task_tree(statuses=[TODO])], ['epic', 'api', 'tests'])
+        self.assertEqual(
+            [s.task.name for s in self.hunt.get_task_tree(starts_with='te')], ['epic', 'api', 'tests'])
+
+    def test_set_parent_and_remove(self):
+        epic = self.hunt.create_task('epic')
+        api = self.hunt.create_task('api', parent_id=epic.id)
+        tests = self.hunt.create_task('tests')
+        self.hunt.set_parent(tests.id, api.id)
+        with self.assertRaises(HuntTaskValidationError):
+            self.hunt.set_parent(epic.id, tests.id)
+        with self.assertRaises(HuntTaskValidationError):
+            self.hunt.set_parent(epic.id, epic.id)
+
+        self.hunt.remove_task(api.id)
+        self.assertEqual(self.hunt.get_task(tests.id).parent_id, epic.id)
+        self.hunt.set_parent(tests.id, None)
+        self.assertEqual(self.hunt.get_task(tests.id).parent_id, None)
+
+    def test_replace_task_keeps_subtasks(self):
+        epic = self.hunt.create_task('epic')
+        api = self.hunt.create_task('api', parent_id=epic.id)
+        task_dict = {
+            'name': 'renamed', 'estimate': 4, 'description': None, 'status': IN_PROGRESS,
+            'history': [(True, 100), (False, 200)],
+        }
+        renamed = self.hunt.replace_task(epic.id, task_dict)
+        self.assertEqual((renamed.id, renamed.name, renamed.estimate), (epic.id, 'renamed', 4))
+        self.assertEqual(self.hunt.get_task(api.id).parent_id, epic.id)
+        self.assertEqual(self.hunt.get_progress(epic.id), 100)
+
+
+class TestTags(TestCase):
+    def setUp(self):
+        self.hunt = Hunt(storage=MemoryStorage())
+
+    def test_filter_by_tags(self):
+        api = self.hunt.create_task('api', tags=['backend', 'urgent'])
+        db = self.hunt.create_task('db', tags=['backend'])
+        ui = self.hunt.create_task('ui')
+        self.hunt.tag_task(ui.id, parse_tags('Frontend, urgent,'))
+
+        def names(tags, any_tag=False):
+            return sorted(task.name for task in self.hunt.get_tasks(tags=tags, any_tag=any_tag))
+
+        self.assertEqual(names(['backend']), ['api', 'db'])
+        self.assertEqual(names(['backend', 'urgent']), ['api'])
+        self.assertEqual(names(['backend', 'frontend'], any_tag=True), ['api', 'db', 'ui'])
+        self.assertEqual(names(['missing']), [])
+        self.assertEqual(
+            self.hunt.get_tags_by_task([ui.id, db.id]),
+            {ui.id: ['frontend', 'urgent'], db.id: ['backend']},
+        )
+
+        self.hunt.untag_task(api.id, ['urgent'])
+        self.assertEqual(names(['urgent']), ['ui'])
+        self.hunt.remove_task(db.id)
+        self.assertEqual(names(['backend']), ['api'])
+        self.assertEqual(self.hunt.storage.execute("SELECT COUNT(*) FROM tags")[0][0], 3)
+
+    def test_tag_lookup_uses_index(self):
+        plans = dict(self.hunt.get_health()["query_plans"])
+        self.assertIn("tags", plans["tasks by tag"])
+        self.assertNotIn("SCAN tags", plans["tasks by tag"])
+
+
+class TestEditWindow(TestCase):
+    def setUp(self):
+        self.hunt = Hunt(storage=MemoryStorage())
+        self.task = self.hunt.create_task('long')
+        # The edit format only knows this century
+        self.t0 = calendar.timegm((2024, 5, 1, 0, 0, 0))
+        for start in range(1000, 6000, 1000):
+            self.hunt.workon_task(self.task.id, at=self.t0 + start)
+            self.hunt.stop_current_task(at=self.t0 + start + 100)
+
+    def test_window(self):
+        preceding, window = self.hunt.get_history_window(self.task.id, last=3)
+        # Widened to whole sessions
+        self.assertEqual([(r.is_start, r.time - self.t0) for r in window],
+                         [(1, 4000), (0, 4100), (1, 5000), (0, 5100)])
+        self.assertEqual((preceding.is_start, preceding.time - self.t0), (0, 3100))
+
+        preceding, window = self.hunt.get_history_window(self.task.id, since=self.t0 + 4050)
+        self.assertEqual([r.time - self.t0 for r in window], [4000, 4100, 5000, 5100])
+        preceding, window = self.hunt.get_history_window(self.task.id, since=self.t0 + 9000)
+        self.assertEqual((window, preceding.time - self.t0), ([], 5100))
+
+    def test_splice_edited_window(self):
+        preceding, window = self.hunt.get_history_window(self.task.id, last=2)
+        display = self.hunt.display_task(self.task.id, history=window)
+        self.assertEqual(display.count('Start'), 1)
+        edited = display.replace(display_time(self.t0 + 5100), display_time(self.t0 + 5400))
+        boundary = (bool(preceding.is_start), preceding.time)
+        task_dict = parse_task(edited, preceding=boundary)
+        self.hunt.replace_task(self.task.id, task_dict, window=window)
+
+        history = self.hunt.get_history(self.task.id)
+        self.assertEqual(len(history), 10)
+        self.assertEqual(history[-1].time, self.t0 + 5400)
+        self.assertEqual(self.hunt.get_progress(self.task.id), 4 * 100 + 400)
+
+        # The window can't go back over the record before it
+        too_early = display.replace(display_time(self.t0 + 5000), display_time(self.t0 + 3000))
+        with self.assertRaises(HuntTaskValidationError):
+            parse_task(too_early, preceding=boundary)
+        # Nor leave a task with history TODO
+        with self.assertRaises(HuntTaskValidationError):
+            parse_task("NAME: long\nESTIMATE: None\nSTATUS: TODO\nDESCRIPTION: None\n\nHISTORY\n",
+                       preceding=boundary)
+
+
+class TestSessions(TestCase):
+    def setUp(self):
+        self.hunt = Hunt(storage=MemoryStorage())
+        self.first = self.hunt.create_task('first')
+        self.second = self.hunt.create_task('second')
+        for taskid, start, stop in [
+            (self.first.id, 100, 200),
+            (self.second.id, 200, 300),
+            (self.first.id, 400, 500),
+        ]:
+            self.hunt.insert_history(History((None, taskid, True, start)))
+            self.hunt.insert_history(History((None, taskid, False, stop)))
+        self.hunt.insert_history(History((None, self.second.id, True, 600)))
+
+    def sessions(self, **kwargs):
+        return [(s.name, s.start, s.stop) for s in self.hunt.iter_sessions(**kwargs)]
+
+    def test_overlapping_sessions(self):
+        self.assertEqual(
+            self.sessions(since=250, until=450),
+            [('second', 200, 300), ('first', 400, 500)],
+        )
+        self.assertEqual(self.sessions(since=300, until=400), [])
+        self.assertEqual(self.sessions(since=550), [('second', 600, None)])
+        self.assertEqual(len(self.sessions()), 4)
+        self.assertEqual([s.name for s in self.hunt.get_sessions_at(450)], ['first'])
+
+    def test_duration_within_range(self):
+        session = self.hunt.get_sessions_at(150)[0]
+        self.assertEqual(session.duration(), 100)
+        self.assertEqual(session.duration(since=150, until=175), 25)
+
+
+class TestParseTime(TestCase):
+    def test_parse_time(self):
+        now = calendar.timegm((2024, 5, 9, 10, 30, 0))  # a Thursday
+        self.assertEqual(parse_time('now', now), now)
+        self.assertEqual(parse_time('2024-05-07 14:00', now), calendar.timegm((2024, 5, 7, 14, 0, 0)))
+        self.assertEqual(parse_time('2024-05-07', now), calendar.timegm((2024, 5, 7, 0, 0, 0)))
+        self.assertEqual(parse_time('08:15', now), calendar.timegm((2024, 5, 9, 8, 15, 0)))
+        self.assertEqual(parse_time('yesterday', now), calendar.timegm((2024, 5, 8, 0, 0, 0)))
+        self.assertEqual(parse_time('Tuesday 14:00', now), calendar.timegm((2024, 5, 7, 14, 0, 0)))
+        self.assertEqual(parse_time('thursday', now), calendar.timegm((2024, 5, 9, 0, 0, 0)))
+        with self.assertRaises(HuntInvalidTimeError):
+            parse_time('someday', now)
+
+
+class TestServe(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.loop = asyncio.new_event_loop()
+        self.server = HuntServer(self.tmp_dir)
+        self.port = self.loop.run_until_complete(self.server.start())
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d' % self.port
+
+    def tearDown(self):
+        asyncio.run_coroutine_threadsafe(self.server.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_operations(self):
+        hunt = RemoteHunt(self.url, 'alice')
+        task = hunt.create_task('remote', estimate=2, tags=['api'])
+        self.assertEqual((task.name, task.estimate), ('remote', 2))
+        hunt.workon_task(task.id, at=100)
+        self.assertEqual(hunt.get_current_task().id, task.id)
+        self.assertEqual(hunt.stop_current_task(at=160).status, IN_PROGRESS)
+        self.assertEqual(hunt.get_progress_by_task([task.id]), {task.id: 60})
+        self.assertEqual(hunt.get_tags_by_task([task.id]), {task.id: ['api']})
+        hunt.finish_task(task.id)
+        self.assertEqual([t.status for t in hunt.get_tasks({FINISHED})], [FINISHED])
+
+        with self.assertRaises(HuntCouldNotFindTaskError):
+            hunt.get_task('missing')
+        with self.assertRaises(HuntError):
+            hunt.backup()
+        # Users don't see each other's tasks
+        self.assertEqual(RemoteHunt(self.url, 'bob').get_tasks(), [])
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir, 'alice.db')))
+
+    def test_concurrent_clients(self):
+        errors = []
+
+        def client(i):
+            try:
+                hunt = RemoteHunt(self.url, 'user%d' % (i % 4))
+                task = hunt.create_task('task-%d' % i)
+                hunt.workon_task(task.id)
+                hunt.get_tasks()
+                hunt.close()
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(200)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        for user in range(4):
+            hunt = RemoteHunt(self.url, 'user%d' % user)
+            self.assertEqual(len(hunt.get_tasks()), 50)
+            self.assertEqual(len(hunt.get_tasks([CURRENT])), 1)
+
+    def test_cli(self):
+        remote, settings.REMOTE = settings.REMOTE, self.url
+        try:
+            console = Console(file=StringIO(), width=200)
+            Command().create({'<task-name>': 'from-cli', '--estimate': None,
+                              '--description': None}, console=console)
+            Command().ls({}, console=console)
+            self.assertIn('from-cli', console.file.getvalue())
+        finally:
+            settings.REMOTE = remote
+
+    def test_cli_edit(self):
+        hunt = RemoteHunt(self.url, settings.REMOTE_USER)
+        task = hunt.create_task('edited')
+        remote, settings.REMOTE = settings.REMOTE, self.url
+        try:
+            console = Console(file=StringIO(), width=200)
+            Command().edit({'<task-identifier>': 'edited', '--tag': 'api'}, console=console)
+            self.assertEqual(hunt.get_tags_by_task([task.id]), {task.id: ['api']})
+            with patch('hunt.cli.call') as editor:
+                with self.assertRaises(HuntError):
+                    Command().edit({'<task-identifier>': 'edited'}, console=console)
+            editor.assert_not_called()
+        finally:
+            settings.REMOTE = remote
+
+    def test_git_sync_skips_journal(self):
+        git_dir = os.path.join(self.tmp_dir, 'repo', '.git')
+        os.makedirs(git_dir)
+        with open(os.path.join(git_dir, 'HEAD'), 'w') as f:
+            f.write('ref: refs/heads/feature\n')
+        saved = settings.REMOTE, settings.JOURNAL, os.getcwd()
+        settings.REMOTE, settings.JOURNAL = self.url, True
+        try:
+            os.chdir(os.path.dirname(git_dir))
+            Command().git_sync({'--print': False, '--install': False, '--force': False},
+                               console=Console(file=StringIO()))
+        finally:
+            settings.REMOTE, settings.JOURNAL = saved[:2]
+            os.chdir(saved[2])
+        self.assertEqual(RemoteHunt(self.url, settings.REMOTE_USER).get_current_task().name, 'feature')
+
+
+class TestRemoteRetry(TestCase):
+    def test_writes_are_not_sent_twice(self):
+        # Answers the first request, then reads each request and hangs up
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen()
+        received = []
+
+        def serve():
+            listener.settimeout(1)
+            try:
+                while True:
+                    conn, _ = listener.accept()
+                    requests = conn.makefile('rb')
+                    while requests.readline():
+                        headers = {}
+                        for line in iter(requests.readline, b'\r\n'):
+                            name, _, value = line.decode().partition(':')
+                            headers[name.lower()] = value.strip()
+                        requests.read(int(headers['content-length']))
+                        received.append(True)
+                        if len(received) > 1:
+                            break
+                        conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 4\r\n\r\nnull')
+                    requests.close()
+                    conn.close()
+            except socket.timeout:
+                listener.close()
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+        hunt = RemoteHunt('http://127.0.0.1:%d' % listener.getsockname()[1], 'alice', timeout=5)
+        hunt.finish_task(1)
+        with self.assertRaises(HuntError):
+            hunt.finish_task(1)
+        thread.join()
+        self.assertEqual(len(received), 2)
+
+
+class TestCheck(TestCase):
+    def setUp(self):
+        self.hunt = Hunt(storage=MemoryStorage())
+
+    def add(self, taskid, is_start, time):
+        self.hunt.insert_history(History((None, taskid, is_start, time)))
+
+    def test_consistent_database(self):
+        first = self.hunt.create_task('first')
+        second = self.hunt.create_task('second')
+        self.hunt.workon_task(first.id, at=100)
+        self.hunt.workon_task(second.id, at=200)
+        self.hunt.stop_current_task(at=200)
+        self.hunt.workon_task(second.id, at=300)
+        self.assertEqual(self.hunt.check(), [])
+
+    def test_find_and_fix(self):
+        first = self.hunt.create_task('first')
+        second = self.hunt.create_task('second')
+        third = self.hunt.create_task('third')
+        self.add(first.id, True, 100)
+        self.add(second.id, True, 150)  # overlaps first
+        self.add(first.id, False, 200)  # then unpaired
+        self.add(second.id, False, 250)
+        self.add(second.id, False, 260)  # unpaired
+        self.add(99, True, 270)  # orphan
+        self.add(third.id, True, 300)  # never stopped
+        self.hunt.update_task(first.id, 'status', CURRENT)
+        self.hunt.update_task(second.id, 'status', CURRENT)
+
+        problems = self.hunt.check(fix=True)
+        self.assertEqual(
+            sorted(problem.kind for problem in problems),
+            sorted([OVERLAP, UNPAIRED_STOP, UNPAIRED_STOP, ORPHAN, MULTIPLE_CURRENT,
+                    UNPAIRED_START, WRONG_STATUS, WRONG_STATUS]),
+        )
+        self.assertEqual(self.hunt.check(), [])
+        self.assertEqual(
+            [(r.is_start, r.time) for r in self.hunt.get_history(first.id)], [(1, 100), (0, 150)])
+        self.assertEqual(self.hunt.get_task(third.id).status, IN_PROGRESS)
+        self.assertEqual(self.hunt.get_current_task(required=False), None)
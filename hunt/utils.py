@@ -11,11 +11,14 @@ import time
 from hunt import settings
 from .constants import CURRENT
 from .constants import FINISHED
+from .constants import HuntInvalidTimeError
 from .constants import HuntTaskValidationError
 from .constants import IN_PROGRESS
 from .constants import TODO
 
 TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+DAY_SECONDS = 24 * 60 * 60
 
 grammar = Grammar(r"""
     task = name newline+
@@ -119,9 +122,9 @@ class TaskVisitor(NodeVisitor):
         return children
 
 
-def parse_task(task_display):
+def parse_task(task_display, preceding=None):
     task_dict = TaskVisitor().parse(task_display)
-    validate_task_dict(task_dict)
+    validate_task_dict(task_dict, preceding=preceding)
     return task_dict
 
 
@@ -131,32 +134,44 @@ def hunt_assert(expr, message):
         raise HuntTaskValidationError(error_message)
 
 
-def validate_task_dict(task_dict):
+def validate_task_dict(task_dict, preceding=None):
+    """
+    When only a window at the end of the task's history was edited,
+    `preceding` is the (is_start, time) record just before it, which the
+    window has to carry on from.
+    """
+    history = task_dict['history']
+    last_history_record = history[-1] if history else preceding
     if task_dict['status'] == TODO:
         hunt_assert(
-            len(task_dict['history']) == 0,
+            last_history_record is None,
             "Can't have a history if the status is TODO")
     else:
         hunt_assert(
-            len(task_dict['history']) > 0,
+            last_history_record is not None,
             "Must have a history if status is %s" % task_dict['status'])
 
     if task_dict['status'] == CURRENT:
-        last_history_record = task_dict['history'][-1]
         hunt_assert(
             last_history_record[0] is True,
             "Last history record must be a Start if the status is Current")
     elif task_dict['status'] in [IN_PROGRESS, FINISHED]:
-        last_history_record = task_dict['history'][-1]
         hunt_assert(
             last_history_record[0] is False,
             "Last history record must be a Stop if the status is %s" %
             task_dict['status'])
 
-    if task_dict['history']:
+    if history:
         expect_start = True
         last_history_time = 0
-        for is_start, history_time in task_dict['history']:
+        if preceding is not None:
+            hunt_assert(
+                preceding[1] < history[0][1],
+                "History must come after the %s at %s just before it" %
+                ("Start" if preceding[0] else "Stop", display_time(preceding[1])))
+            expect_start = not preceding[0]
+            last_history_time = preceding[1]
+        for is_start, history_time in history:
             hunt_assert(
                 last_history_time < history_time,
                 "History must be in ascending order by time")
@@ -180,11 +195,65 @@ def calc_progress(task_history):
         else:
             progress += history_record.time - start_time
             start_time = None
-    if task_history and start_time:
+    if start_time:
         progress += int(time.time()) - start_time
     return progress
 
 
+def parse_time(text, now):
+    """
+    Parse a time given on the command line. Like every time hunt displays,
+    it's in UTC. Accepts "now", "2024-05-07 14:00[:00]", "2024-05-07",
+    "14:00" (today), and "today", "yesterday" or a weekday (the most recent
+    one, today included), each optionally followed by a time of day.
+    """
+    text = " ".join(text.lower().split())
+    if text == "now":
+        return now
+    for time_format in (TIME_FORMAT, "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return calendar.timegm(strptime(text, time_format))
+        except ValueError:
+            pass
+
+    day, _, time_of_day = text.partition(" ")
+    today = now - now % DAY_SECONDS
+    if day == "today":
+        midnight = today
+    elif day == "yesterday":
+        midnight = today - DAY_SECONDS
+    elif day in WEEKDAYS:
+        days_ago = (gmtime(now).tm_wday - WEEKDAYS.index(day)) % 7
+        midnight = today - days_ago * DAY_SECONDS
+    else:
+        midnight = today
+        time_of_day = text
+
+    if not time_of_day:
+        return midnight
+    for time_format in ("%H:%M:%S", "%H:%M"):
+        try:
+            parsed = strptime(time_of_day, time_format)
+            return midnight + parsed.tm_hour * 3600 + parsed.tm_min * 60 + parsed.tm_sec
+        except ValueError:
+            pass
+    raise HuntInvalidTimeError(f"[red]Error[/red]: Could not understand time [yellow]{text}[/yellow]")
+
+
+def parse_tags(text):
+    """Comma separated tags, lower cased and without duplicates."""
+    return sorted({tag.strip().lower() for tag in text.split(",") if tag.strip()})
+
+
+def display_estimate(estimate):
+    estimate_display_str = ""
+    if estimate is not None:
+        estimate_display_str = "%d hr" % estimate
+        if estimate > 1:
+            estimate_display_str += "s"
+    return estimate_display_str
+
+
 def display_progress(seconds):
     minutes, seconds = divmod(seconds, 60)
     hours, minutes = divmod(minutes, 60)
@@ -5,13 +5,17 @@ from os import path
 
 here = path.abspath(path.dirname(__file__))
 
+# Get the version without importing the package (and its dependencies)
+with open(path.join(here, 'hunt', '__init__.py'), encoding='utf-8') as f:
+    version = f.read().split("'")[1]
+
 # Get the long description from the README file
 with open(path.join(here, 'README.md'), encoding='utf-8') as f:
     long_description = f.read()
 
 setup(
     name='hunt',
-    version='1.0.0',
+    version=version,
     author='Alejandro Frias',
     author_email='alejandro.frias@ymail.com',
     description="A CLI TODO list w/ time tracking.",